@@ -0,0 +1,78 @@
+import os
+
+# Production entry point (run.py is the debug/development server).
+# Worker processes and threads are configured through environment variables:
+#   WEB_HOST, WEB_PORT       - bind address (default 0.0.0.0:5001)
+#   WEB_WORKERS              - worker processes; each one loads its own Whisper model, so size this to RAM (default 2)
+#   WEB_SPARE_THREADS        - threads per worker kept for non-inference routes (dashboard, downloads, upload
+#                              chunks) while every inference thread is busy or queued (default 4)
+#   WEB_THREADS              - request threads per worker. Default: INFERENCE_MAX_PER_PROCESS + INFERENCE_QUEUE_SIZE
+#                              + WEB_SPARE_THREADS. It must be larger than INFERENCE_MAX_PER_PROCESS + INFERENCE_QUEUE_SIZE,
+#                              otherwise the admission queue never fills and excess requests wait in the server's
+#                              own backlog instead of getting a fast 503.
+#   WEB_BACKLOG              - connections the OS holds before they are accepted (default 64)
+#   WEB_TIMEOUT              - seconds before a silent worker is restarted; must cover the longest transcription (default 600)
+# Inference concurrency itself is limited by the INFERENCE_* settings in tts_stt_app/app.py (read here with the
+# same defaults to size the thread pool).
+HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+PORT = int(os.environ.get('WEB_PORT', 5001))
+WORKERS = int(os.environ.get('WEB_WORKERS', 2))
+INFERENCE_MAX_PER_PROCESS = int(os.environ.get('INFERENCE_MAX_PER_PROCESS', 1))
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 8))
+SPARE_THREADS = int(os.environ.get('WEB_SPARE_THREADS', 4))
+THREADS = int(os.environ.get('WEB_THREADS', INFERENCE_MAX_PER_PROCESS + INFERENCE_QUEUE_SIZE + SPARE_THREADS))
+BACKLOG = int(os.environ.get('WEB_BACKLOG', 64))
+TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 600))
+
+
+def check_thread_budget():
+    """Refuses to start when the thread pool is too small for the admission queue to ever fill (see WEB_THREADS)."""
+    admission_threads = INFERENCE_MAX_PER_PROCESS + INFERENCE_QUEUE_SIZE
+    if THREADS <= admission_threads:
+        raise SystemExit(f"WEB_THREADS ({THREADS}) must be greater than INFERENCE_MAX_PER_PROCESS + INFERENCE_QUEUE_SIZE "
+                         f"({admission_threads}), or excess requests queue in the server instead of getting 503. "
+                         f"Raise WEB_THREADS or lower INFERENCE_QUEUE_SIZE.")
+
+
+def serve_with_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{HOST}:{PORT}")
+            self.cfg.set('workers', WORKERS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', THREADS)
+            # Accept no more connections than there are threads: the rest stay in the (bounded) OS backlog rather than
+            # an unbounded in-worker queue, so overload reaches admission control and is answered with 503
+            self.cfg.set('worker_connections', THREADS)
+            self.cfg.set('backlog', BACKLOG)
+            self.cfg.set('timeout', TIMEOUT)
+            # Each worker builds its own app after fork. The master never imports the app (which loads the Whisper
+            # model and starts threads): PyTorch state and threads do not survive a fork. create_app() serializes
+            # database setup between the workers that start at the same time (see startup_lock in app.py).
+            self.cfg.set('preload_app', False)
+
+        def load(self):
+            from tts_stt_app.app import create_app
+            return create_app()
+
+    StandaloneApplication().run()
+
+
+def serve_with_waitress():
+    # Windows has no gunicorn: single process, so INFERENCE_MAX_PER_PROCESS is the effective limit
+    from waitress import serve
+    from tts_stt_app.app import create_app
+    print(f"gunicorn not available, serving with waitress on {HOST}:{PORT} ({THREADS} threads)")
+    serve(create_app(), host=HOST, port=PORT, threads=THREADS, connection_limit=THREADS, backlog=BACKLOG)
+
+
+if __name__ == '__main__':
+    check_thread_budget()
+    try:
+        import gunicorn
+    except ImportError:
+        serve_with_waitress()
+    else:
+        serve_with_gunicorn()
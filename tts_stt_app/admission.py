@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, request, Response
+try:
+    import fcntl # POSIX file locks, used for the limit shared by all worker processes
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+    print("fcntl not available (Windows?). Only the per-process inference limit will be enforced.")
+
+# --- Admission control for inference routes ---
+# Every Whisper/Vosk/TTS job needs a slot. A slot is only granted when both the per-process limit and the
+# global limit (shared across server workers through lock files) have room. Requests that cannot get a slot
+# wait in a bounded queue; when the queue is full, or the wait times out, they get 503 + Retry-After at once
+# instead of piling up more inferences and pushing the machine into swap.
+
+
+class InferenceAdmission:
+    def __init__(self, max_per_process=1, max_global=2, max_queue=8, queue_timeout=30, retry_after=10, slot_dir=None):
+        self.max_per_process = max_per_process
+        self.max_global = max_global
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.slot_dir = slot_dir
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        if slot_dir and FCNTL_AVAILABLE and not os.path.exists(slot_dir):
+            os.makedirs(slot_dir)
+
+    def _try_global_slot(self):
+        """Returns an open, flock'ed slot file, or None if all max_global slots are held by some worker. True means no global slot is needed."""
+        if not (self.slot_dir and FCNTL_AVAILABLE and self.max_global):
+            return True
+        for slot_number in range(self.max_global):
+            slot_file = open(os.path.join(self.slot_dir, f"slot-{slot_number}.lock"), 'a')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_file # The lock is dropped when this file is closed (or the process dies)
+            except OSError:
+                slot_file.close()
+        return None
+
+    def _try_acquire_locked(self):
+        if self._active >= self.max_per_process:
+            return None
+        slot = self._try_global_slot()
+        if slot is None:
+            return None
+        self._active += 1
+        return slot
+
+    def acquire(self):
+        """Returns a slot token for release(), or None if the request should be rejected."""
+        with self._condition:
+            slot = self._try_acquire_locked()
+            if slot is not None:
+                return slot
+            if self._waiting >= self.max_queue:
+                return None # Queue full: reject immediately
+            self._waiting += 1
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    # Woken by release() in this process; the short timeout also re-polls slots freed by other workers
+                    self._condition.wait(min(remaining, 0.1))
+                    slot = self._try_acquire_locked()
+                    if slot is not None:
+                        return slot
+            finally:
+                self._waiting -= 1
+
+    def release(self, slot):
+        if slot is not True:
+            slot.close()
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def busy_response(self):
+        return Response("The server is busy with other conversions. Please try again shortly.", status=503,
+                        headers={'Retry-After': str(self.retry_after)}, mimetype='text/plain')
+
+
+def init_admission(app):
+    """Creates the app's InferenceAdmission from config (see INFERENCE_* in app.py)."""
+    app.extensions['inference_admission'] = InferenceAdmission(
+        max_per_process=app.config['INFERENCE_MAX_PER_PROCESS'],
+        max_global=app.config['INFERENCE_MAX_GLOBAL'],
+        max_queue=app.config['INFERENCE_QUEUE_SIZE'],
+        queue_timeout=app.config['INFERENCE_QUEUE_TIMEOUT'],
+        retry_after=app.config['INFERENCE_RETRY_AFTER'],
+        slot_dir=os.path.join(app.instance_path, 'inference_slots'),
+    )
+
+
+def get_admission():
+    return current_app.extensions['inference_admission']
+
+
+def inference_limited(view):
+    """Route decorator: POST requests (the ones that run inference) must hold an inference slot. GETs pass through."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if request.method != 'POST':
+            return view(*args, **kwargs)
+        admission = get_admission()
+        slot = admission.acquire()
+        if slot is None:
+            print(f"Admission control: rejected {request.path} (server saturated)")
+            return admission.busy_response()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release(slot)
+    return wrapped
@@ -1,13 +1,79 @@
 import os
-from flask import Flask, render_template, redirect, url_for
-from flask_login import LoginManager, current_user
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Flask, render_template, redirect, url_for, flash, current_app, request, Response, stream_with_context, abort
+from flask_login import LoginManager, current_user, login_required
 from flask_wtf.csrf import CSRFProtect
 from flask_bootstrap import Bootstrap5 # For WTForms Bootstrap styling
 
-from .models import db, User, init_db as init_database
+from .models import db, User, ConversionLog, UsageRollup, init_db as init_database
 from .auth import auth_bp
 from .tts import tts_bp
-from .stt import stt_bp
+from .stt import stt_bp, init_upload_cleanup
+from .search import search_bp, init_search_index, remove_from_index
+from .admission import init_admission
+from .utils.history_tools import conversion_file_paths, remove_files_async, stream_zip
+try:
+    import fcntl # Serializes database setup between server workers (see startup_lock)
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False # Windows: waitress runs a single process, so there is nothing to serialize
+
+# Engines that can be used to filter the conversion history (see filtered_logs_query)
+HISTORY_ENGINES = ['whisper', 'vosk', 'auto', 'espeak', 'festival', 'pyttsx3']
+BULK_DELETE_BATCH_SIZE = 500 # Ids per DELETE statement, under SQLite's bound-parameter limit
+STATS_DEFAULT_DAYS = 30
+
+def filtered_logs_query(user_id, filters):
+    """
+    Builds the ConversionLog query for a user's history filters (request.args or request.form):
+    type ('TTS'/'STT'), engine (see HISTORY_ENGINES), date_from/date_to ('YYYY-MM-DD', inclusive).
+    """
+    query = ConversionLog.query.filter_by(user_id=user_id)
+    log_type = filters.get('type')
+    if log_type in ('TTS', 'STT'):
+        query = query.filter(ConversionLog.type == log_type)
+    engine = filters.get('engine')
+    if engine == 'auto':
+        query = query.filter(ConversionLog.language.like('auto->%'))
+    elif engine in HISTORY_ENGINES:
+        # Newer logs record the engine that ran; older ones only have it as a prefix of the language field,
+        # e.g. "whisper: en", "espeak:en" or "auto->vosk: en-us"
+        query = query.filter((ConversionLog.engine == engine) |
+                             ConversionLog.language.like(f'{engine}:%') | ConversionLog.language.like(f'auto->{engine}:%'))
+    try:
+        if filters.get('date_from'):
+            query = query.filter(ConversionLog.timestamp >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+        if filters.get('date_to'):
+            query = query.filter(ConversionLog.timestamp < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        pass # Ignore malformed dates rather than failing the whole page
+    return query
+
+def history_filter_args(filters):
+    """The active history filters, for carrying them across redirects."""
+    return {key: filters[key] for key in ('type', 'engine', 'date_from', 'date_to') if filters.get(key)}
+
+def selected_logs_query(user_id, form):
+    """The logs a bulk action applies to: every log matching the filters if 'select_all' is set, else the ticked log_ids."""
+    query = filtered_logs_query(user_id, form)
+    if form.get('select_all') == '1':
+        return query
+    log_ids = [int(log_id) for log_id in form.getlist('log_ids') if log_id.isdigit()]
+    return query.filter(ConversionLog.id.in_(log_ids))
+
+@contextmanager
+def startup_lock(lock_path):
+    """
+    Holds an exclusive file lock for the duration of the block. Server workers all run create_app() at once, and the
+    schema upgrade (add_missing_columns) and search backfill must not run in two of them at the same time.
+    """
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when the file is closed
+        yield
 
 def create_app():
     app = Flask(__name__)
@@ -16,6 +82,18 @@ def create_app():
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_secret_key_here_change_me') # IMPORTANT: Change this in production!
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database/app.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # TTS output defaults, used when the form leaves format/bitrate on "Server default" ('ogg', 'mp3' or 'wav'; bitrate e.g. '24k')
+    app.config['TTS_DEFAULT_FORMAT'] = os.environ.get('TTS_DEFAULT_FORMAT', 'mp3')
+    app.config['TTS_DEFAULT_BITRATE'] = os.environ.get('TTS_DEFAULT_BITRATE') # None means the format's own default
+    # Admission control for inference routes (see admission.py). Whisper already uses every core for one job,
+    # so by default each worker runs one inference and the whole server at most two.
+    app.config['INFERENCE_MAX_PER_PROCESS'] = int(os.environ.get('INFERENCE_MAX_PER_PROCESS', 1))
+    app.config['INFERENCE_MAX_GLOBAL'] = int(os.environ.get('INFERENCE_MAX_GLOBAL', 2)) # Across all worker processes
+    app.config['INFERENCE_QUEUE_SIZE'] = int(os.environ.get('INFERENCE_QUEUE_SIZE', 8)) # Waiting requests per worker
+    app.config['INFERENCE_QUEUE_TIMEOUT'] = float(os.environ.get('INFERENCE_QUEUE_TIMEOUT', 30)) # Seconds before a waiting request gets 503
+    app.config['INFERENCE_RETRY_AFTER'] = int(os.environ.get('INFERENCE_RETRY_AFTER', 10)) # Retry-After header on 503
+    # Accounts allowed to see server-wide usage (/stats), comma-separated. Empty means nobody.
+    app.config['OPERATOR_EMAILS'] = {email.strip().lower() for email in os.environ.get('OPERATOR_EMAILS', '').split(',') if email.strip()}
 
     # Ensure the instance folder exists
     try:
@@ -43,7 +121,11 @@ def create_app():
     # Initialize extensions
     Bootstrap5(app) # For Bootstrap styling of WTForms
     CSRFProtect(app)
-    init_database(app) # Initialize database using the function from models.py
+    with startup_lock(os.path.join(app.instance_path, 'startup.lock')): # One worker at a time
+        init_database(app) # Initialize database using the function from models.py
+        init_search_index(app) # FTS5 index over transcripts and TTS input text
+    init_admission(app) # Concurrency limits for inference routes
+    init_upload_cleanup(app) # Removes abandoned chunked uploads
 
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -58,6 +140,7 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(tts_bp)
     app.register_blueprint(stt_bp)
+    app.register_blueprint(search_bp)
 
     # Basic routes
     @app.route('/')
@@ -67,8 +150,85 @@ def create_app():
     @app.route('/dashboard')
     @login_required # Ensure only logged-in users can access
     def dashboard():
-        user_logs = ConversionLog.query.filter_by(user_id=current_user.id).order_by(ConversionLog.timestamp.desc()).all()
-        return render_template('dashboard.html', logs=user_logs)
+        user_logs = filtered_logs_query(current_user.id, request.args).order_by(ConversionLog.timestamp.desc()).all()
+        return render_template('dashboard.html', logs=user_logs, filters=request.args, engines=HISTORY_ENGINES)
+
+    @app.route('/stats')
+    @login_required
+    def stats():
+        if not current_user.is_operator: # Rollups cover all users
+            abort(403)
+        # Reads only the pre-aggregated usage_rollups table (one row per day/type/engine), never conversion_logs
+        days = min(max(request.args.get('days', STATS_DEFAULT_DAYS, type=int), 1), 366)
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        daily_rollups = UsageRollup.query.filter(UsageRollup.day >= since).order_by(
+            UsageRollup.day.desc(), UsageRollup.type, UsageRollup.engine).all()
+
+        # Per-engine totals for the period, summed from the daily rows
+        engine_totals = {}
+        for rollup in daily_rollups:
+            totals = engine_totals.setdefault((rollup.type, rollup.engine), UsageRollup(
+                type=rollup.type, engine=rollup.engine, conversions=0, audio_seconds=0.0, processing_seconds=0.0, output_bytes=0,
+                skipped_audio_seconds=0.0))
+            totals.conversions += rollup.conversions
+            totals.audio_seconds += rollup.audio_seconds
+            totals.processing_seconds += rollup.processing_seconds
+            totals.output_bytes += rollup.output_bytes
+            totals.skipped_audio_seconds += rollup.skipped_audio_seconds or 0.0
+
+        return render_template('stats.html', days=days, daily_rollups=daily_rollups,
+                               engine_totals=sorted(engine_totals.values(), key=lambda t: (t.type, t.engine)))
+
+    @app.route('/logs/bulk_delete', methods=['POST'])
+    @login_required
+    def bulk_delete_logs():
+        logs = selected_logs_query(current_user.id, request.form).with_entities(
+            ConversionLog.id, ConversionLog.user_id, ConversionLog.type, ConversionLog.output_filename).all()
+        if not logs:
+            flash("No logs selected.", "warning")
+            return redirect(url_for('dashboard', **history_filter_args(request.form)))
+
+        log_ids = [log.id for log in logs]
+        files_to_delete = [path for log in logs for path in conversion_file_paths(current_app.root_path, log)]
+        try:
+            # One transaction for the whole selection, in batched DELETE statements
+            remove_from_index(log_ids)
+            for start in range(0, len(log_ids), BULK_DELETE_BATCH_SIZE):
+                ConversionLog.query.filter(ConversionLog.id.in_(log_ids[start:start + BULK_DELETE_BATCH_SIZE])).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f"Error deleting logs: {str(e)}", "danger")
+            print(f"Error during bulk deletion: {e}")
+            return redirect(url_for('dashboard', **history_filter_args(request.form)))
+
+        # Files are only removed once the rows are gone; the request doesn't wait for the disk work
+        remove_files_async(files_to_delete)
+        flash(f"Deleted {len(log_ids)} log entries. Their files are being removed in the background.", "success")
+        return redirect(url_for('dashboard', **history_filter_args(request.form)))
+
+    @app.route('/logs/export', methods=['POST'])
+    @login_required
+    def export_logs():
+        logs = selected_logs_query(current_user.id, request.form).order_by(ConversionLog.timestamp).all()
+        if not logs:
+            flash("No logs selected.", "warning")
+            return redirect(url_for('dashboard', **history_filter_args(request.form)))
+
+        entries = []
+        manifest_rows = []
+        for log in logs:
+            for path in conversion_file_paths(current_app.root_path, log):
+                entries.append((path, f"{log.type.lower()}/{os.path.basename(path)}"))
+            manifest_rows.append({
+                'id': log.id, 'type': log.type, 'language': log.language,
+                'timestamp': log.timestamp.isoformat(), 'output_filename': log.output_filename,
+                'input_text': log.input_text or '',
+            })
+
+        export_name = f"conversion_history_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+        return Response(stream_with_context(stream_zip(entries, manifest_rows)), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{export_name}"'})
 
     @app.route('/delete_log/<int:log_id>', methods=['POST'])
     @login_required
@@ -105,6 +265,7 @@ def create_app():
             elif file_to_delete_path:
                 flash(f"File {log_entry.output_filename} not found, but log entry will be deleted.", "warning")
 
+            remove_from_index([log_entry.id])
             db.session.delete(log_entry)
             db.session.commit()
             flash("Log entry deleted successfully.", "success")
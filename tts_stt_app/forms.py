@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, TextAreaField, SelectField
+from wtforms import StringField, PasswordField, SubmitField, TextAreaField, SelectField, BooleanField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
 from .models import User
+from .utils.audio_tools import BITRATE_CHOICES
 
 class RegistrationForm(FlaskForm):
     name = StringField('Full Name', validators=[DataRequired(), Length(min=2, max=100)])
@@ -32,6 +33,15 @@ class TTSForm(FlaskForm):
         ('festival', 'Festival (Potentially more natural, setup intensive)'),
         ('pyttsx3', 'pyttsx3 (System voices, quality varies)')
     ], default='espeak', validators=[DataRequired()])
+    # Empty choice means the server default (TTS_DEFAULT_FORMAT / TTS_DEFAULT_BITRATE in app.config)
+    output_format = SelectField('Output Format', choices=[
+        ('', 'Server default'),
+        ('ogg', 'Opus/OGG (Smallest, best for speech)'),
+        ('mp3', 'MP3 (Widest compatibility)'),
+        ('wav', 'WAV (Uncompressed)')
+    ], default='', validators=[])
+    bitrate = SelectField('Bitrate', choices=[('', 'Format default')] + [(rate, rate.replace('k', ' kbps')) for rate in BITRATE_CHOICES],
+                          default='', validators=[]) # Ignored for WAV
     # Festival voice selection could be added if needed, similar to Vosk language
     # festival_voice = SelectField('Festival Voice', choices=[('kal_diphone', 'English (Kal Diphone - Default)'), ...], validators=[])
     submit = SubmitField('Convert to Speech')
@@ -45,7 +55,8 @@ class STTForm(FlaskForm):
     # ]) # Optional: if explicit language choice is desired over auto-detect
     stt_engine = SelectField('Transcription Engine', choices=[
         ('whisper', 'Whisper (Multilingual, Slower, Higher Accuracy)'),
-        ('vosk', 'Vosk (Language Specific Models, Faster, Lighter)')
+        ('vosk', 'Vosk (Language Specific Models, Faster, Lighter)'),
+        ('auto', 'Auto (Detect language, use Vosk when a model exists, else Whisper)')
     ], default='whisper', validators=[DataRequired()])
     vosk_language = SelectField('Vosk Language Model', choices=[
         ('en-us', 'English (US)'),
@@ -53,6 +64,7 @@ class STTForm(FlaskForm):
         # These choices should map to available Vosk model directories/names.
         # This field will be shown/hidden by JS based on stt_engine selection.
     ], validators=[]) # Optional validator if Vosk is selected
+    trim_silence = BooleanField('Skip silence (faster for meetings and voicemails with long pauses)', default=False)
     submit_upload = SubmitField('Transcribe Uploaded File')
     submit_record = SubmitField('Transcribe Recording') # This might be triggered by JS
 
@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 db = SQLAlchemy()
 
@@ -15,6 +17,11 @@ class User(UserMixin, db.Model):
 
     conversion_logs = db.relationship('ConversionLog', backref='user', lazy=True)
 
+    @property
+    def is_operator(self):
+        """Operators (OPERATOR_EMAILS in app.config) may see server-wide pages such as /stats."""
+        return self.email.lower() in current_app.config.get('OPERATOR_EMAILS', set())
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -32,13 +39,105 @@ class ConversionLog(db.Model):
     language = db.Column(db.String(50))
     input_text = db.Column(db.Text, nullable=True) # For TTS
     output_filename = db.Column(db.String(255)) # Path to audio or text file
+    output_format = db.Column(db.String(10), nullable=True) # TTS audio format: 'ogg', 'mp3' or 'wav' (None for old MP3 logs)
+    # Processing metrics (None for logs created before they were recorded)
+    engine = db.Column(db.String(20), nullable=True) # Engine that actually ran: whisper, vosk, espeak, festival, pyttsx3
+    model = db.Column(db.String(100), nullable=True) # Whisper model name, Vosk model directory or TTS voice
+    audio_duration = db.Column(db.Float, nullable=True) # Seconds of audio transcribed (STT) or produced (TTS)
+    processing_time = db.Column(db.Float, nullable=True) # Wall-clock seconds spent decoding/inferring/encoding
+    output_bytes = db.Column(db.Integer, nullable=True) # Size of the output file
+    vad_skipped_seconds = db.Column(db.Float, nullable=True) # STT: silence removed before inference (None if trimming was off)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<ConversionLog {self.id} by User {self.user_id}>'
 
+class UploadSession(db.Model):
+    """A resumable, chunked STT upload. Chunks are appended to a .part file until received_bytes == total_size."""
+    __tablename__ = 'upload_sessions'
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex, also the .part filename
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False) # Original (secured) filename, for the extension
+    total_size = db.Column(db.Integer, nullable=False)
+    received_bytes = db.Column(db.Integer, nullable=False, default=0)
+    stt_engine = db.Column(db.String(20), nullable=False)
+    vosk_language = db.Column(db.String(50), nullable=True)
+    trim_silence = db.Column(db.Boolean, nullable=True, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow) # Last chunk; sessions idle too long are expired
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.received_bytes}/{self.total_size}>'
+
+class UsageRollup(db.Model):
+    """
+    Per-day, per-engine totals maintained incrementally by record_usage(), so the stats view never scans conversion_logs.
+    Rollups count work done: deleting a log does not subtract from them.
+    """
+    __tablename__ = 'usage_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    type = db.Column(db.String(10), nullable=False) # TTS or STT
+    engine = db.Column(db.String(20), nullable=False)
+    conversions = db.Column(db.Integer, nullable=False, default=0)
+    audio_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    processing_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    output_bytes = db.Column(db.Integer, nullable=False, default=0)
+    skipped_audio_seconds = db.Column(db.Float, nullable=True, default=0.0) # Silence not sent to STT engines (see vad_tools.py)
+    __table_args__ = (db.UniqueConstraint('day', 'type', 'engine', name='uq_usage_rollup_day_type_engine'),)
+
+    @property
+    def real_time_factor(self):
+        """Processing seconds per second of audio (below 1.0 is faster than real time)."""
+        return self.processing_seconds / self.audio_seconds if self.audio_seconds else None
+
+    def __repr__(self):
+        return f'<UsageRollup {self.day} {self.type} {self.engine}>'
+
+def record_usage(log):
+    """Adds a conversion's metrics to its day/engine rollup row (an upsert in the caller's transaction)."""
+    day = (log.timestamp or datetime.utcnow()).date()
+    values = {
+        'day': day, 'type': log.type, 'engine': log.engine or 'unknown', 'conversions': 1,
+        'audio_seconds': log.audio_duration or 0.0,
+        'processing_seconds': log.processing_time or 0.0,
+        'output_bytes': log.output_bytes or 0,
+        'skipped_audio_seconds': log.vad_skipped_seconds or 0.0,
+    }
+    statement = sqlite_insert(UsageRollup.__table__).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', 'type', 'engine'],
+        set_={
+            'conversions': UsageRollup.__table__.c.conversions + 1,
+            'audio_seconds': UsageRollup.__table__.c.audio_seconds + values['audio_seconds'],
+            'processing_seconds': UsageRollup.__table__.c.processing_seconds + values['processing_seconds'],
+            'output_bytes': UsageRollup.__table__.c.output_bytes + values['output_bytes'],
+            # Column was added after rollups existed, so older rows may hold NULL
+            'skipped_audio_seconds': db.func.coalesce(UsageRollup.__table__.c.skipped_audio_seconds, 0.0) + values['skipped_audio_seconds'],
+        }
+    )
+    db.session.execute(statement)
+
+def add_missing_columns():
+    """
+    db.create_all() only creates missing tables, so columns added to a model later are added here
+    with ALTER TABLE (new columns are always nullable, so existing rows stay valid).
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                print(f"Adding column {table.name}.{column.name} ({column_type})")
+                with db.engine.begin() as connection:
+                    connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
 def init_db(app):
     """Initializes the database."""
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        add_missing_columns()
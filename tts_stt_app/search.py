@@ -0,0 +1,145 @@
+import os
+from markupsafe import escape
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import OperationalError
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask_login import login_required, current_user
+from .models import db, ConversionLog
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+# --- Full-text index over STT transcripts and TTS input text ---
+# SQLite FTS5 virtual table; rowid is the ConversionLog id.
+# 'owner' holds a per-user token (e.g. 'u42') so a query only ever intersects that user's documents.
+SEARCH_TABLE = 'conversion_search'
+FTS_AVAILABLE = False
+RESULTS_PER_PAGE = 20
+SNIPPET_TOKENS = 16
+ID_BATCH_SIZE = 500 # Ids per IN (...) list; stays well under SQLite's bound-parameter limit
+# Control characters used as highlight markers inside snippet(); swapped for <mark> after HTML-escaping
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+def _owner_token(user_id):
+    return f"u{user_id}"
+
+def init_search_index(app):
+    """Creates the FTS5 table if needed and indexes any logs written before the index existed."""
+    global FTS_AVAILABLE
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                "USING fts5(content, owner, tokenize='unicode61 remove_diacritics 2')"
+            ))
+            db.session.commit()
+            FTS_AVAILABLE = True
+        except OperationalError as e:
+            db.session.rollback()
+            print(f"SQLite FTS5 not available, transcript search disabled: {e}")
+            return
+        _backfill_index(app.root_path)
+
+def _backfill_index(root_path):
+    missing_ids = db.session.execute(text(
+        f"SELECT id FROM {ConversionLog.__tablename__} WHERE id NOT IN (SELECT rowid FROM {SEARCH_TABLE})"
+    )).scalars().all()
+    if not missing_ids:
+        return
+    print(f"Indexing {len(missing_ids)} existing conversion logs for search...")
+    # Loaded and committed in batches: one IN (...) over every id would exceed SQLite's bound-parameter limit
+    for start in range(0, len(missing_ids), ID_BATCH_SIZE):
+        batch_ids = missing_ids[start:start + ID_BATCH_SIZE]
+        for log in ConversionLog.query.filter(ConversionLog.id.in_(batch_ids)).all():
+            content = log.input_text or ''
+            if log.type == 'STT' and log.output_filename:
+                txt_path = os.path.join(root_path, 'static', 'text', str(log.user_id), log.output_filename)
+                if os.path.exists(txt_path):
+                    with open(txt_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+            index_conversion(log, content)
+        db.session.commit()
+        db.session.expunge_all() # Keep the session from accumulating every log
+
+def index_conversion(log, content):
+    """Adds a log's searchable text (transcript or TTS input) to the index. Runs in the caller's transaction; log must be flushed."""
+    if not FTS_AVAILABLE:
+        return
+    db.session.execute(
+        text(f"INSERT INTO {SEARCH_TABLE} (rowid, content, owner) VALUES (:id, :content, :owner)"),
+        {'id': log.id, 'content': content or '', 'owner': _owner_token(log.user_id)}
+    )
+
+def remove_from_index(log_ids):
+    """Removes logs from the index in batches. Runs in the caller's transaction."""
+    if not FTS_AVAILABLE or not log_ids:
+        return
+    log_ids = list(log_ids)
+    for start in range(0, len(log_ids), ID_BATCH_SIZE):
+        db.session.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': log_ids[start:start + ID_BATCH_SIZE]}
+        )
+
+def to_fts_query(user_query):
+    """
+    Turns free text into a safe FTS5 query: every term is quoted (so punctuation can't cause syntax errors)
+    and terms are ANDed. A trailing '*' on a term is kept as a prefix search.
+    """
+    terms = []
+    for raw_term in user_query.split():
+        prefix = raw_term.endswith('*')
+        term = raw_term.strip('*').replace('"', '')
+        if term:
+            terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    return ' '.join(terms)
+
+def _render_snippet(raw_snippet):
+    """HTML-escapes the snippet, then turns the highlight markers into <mark> tags."""
+    return str(escape(raw_snippet)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+def search_conversions(user_id, user_query, page=1, per_page=RESULTS_PER_PAGE):
+    """Returns (results, total) for a user's query, ranked by BM25. Each result is a dict with the log and a highlighted snippet."""
+    fts_query = to_fts_query(user_query)
+    if not FTS_AVAILABLE or not fts_query:
+        return [], 0
+    # Terms are restricted to the content column; unscoped, a term like "u1" would also match the owner tokens
+    match = f'owner : "{_owner_token(user_id)}" AND content : ({fts_query})'
+
+    total = db.session.execute(
+        text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"), {'match': match}
+    ).scalar()
+    rows = db.session.execute(
+        text(f"SELECT rowid, snippet({SEARCH_TABLE}, 0, :hl_start, :hl_end, '…', :tokens) "
+             f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"),
+        {'match': match, 'hl_start': HIGHLIGHT_START, 'hl_end': HIGHLIGHT_END, 'tokens': SNIPPET_TOKENS,
+         'limit': per_page, 'offset': (page - 1) * per_page}
+    ).all()
+
+    logs_by_id = {log.id: log for log in ConversionLog.query.filter(ConversionLog.id.in_([row[0] for row in rows])).all()}
+    results = [{'log': logs_by_id[log_id], 'snippet': _render_snippet(raw_snippet)}
+               for log_id, raw_snippet in rows if log_id in logs_by_id]
+    return results, total
+
+@search_bp.route('/')
+@login_required
+def search():
+    user_query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    if user_query and not FTS_AVAILABLE:
+        flash("Search is unavailable: this SQLite build does not support FTS5.", "warning")
+        return redirect(url_for('dashboard'))
+
+    results, total = search_conversions(current_user.id, user_query, page) if user_query else ([], 0)
+    pages = (total + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'query': user_query, 'page': page, 'pages': pages, 'total': total,
+            'results': [{
+                'id': r['log'].id, 'type': r['log'].type, 'language': r['log'].language,
+                'output_filename': r['log'].output_filename,
+                'timestamp': r['log'].timestamp.isoformat(), 'snippet': r['snippet'],
+            } for r in results],
+        })
+    return render_template('search.html', query=user_query, results=results, total=total, page=page, pages=pages)
@@ -1,6 +1,8 @@
 import os
 import whisper # OpenAI Whisper
 import json
+import time
+import threading
 try:
     from vosk import Model as VoskModel, KaldiRecognizer, SetLogLevel
     VOSK_AVAILABLE = True
@@ -9,12 +11,18 @@ except ImportError:
     VOSK_AVAILABLE = False
     print("Vosk library not found. Vosk STT will be unavailable.")
 
-from flask import Blueprint, render_template, request, flash, redirect, url_for, send_from_directory, current_app
+from flask import Blueprint, render_template, request, flash, redirect, url_for, send_from_directory, current_app, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from .forms import STTForm, STTTextForm # STTTextForm for displaying/downloading text
-from .models import db, ConversionLog
-from datetime import datetime
+from .models import db, ConversionLog, UploadSession, record_usage
+from .search import index_conversion
+from .admission import inference_limited, get_admission
+from .whisper_batcher import WhisperBatcher, transcribe_batched, iter_batched_segments
+from .utils.audio_tools import decode_audio
+from .utils.vad_tools import trim_silence
+from datetime import datetime, timedelta
+import hashlib
 import uuid
 
 stt_bp = Blueprint('stt', __name__, url_prefix='/stt')
@@ -49,6 +57,25 @@ if WHISPER_MODEL_NAME: # Only load if a model name is configured
         print(f"Please ensure the model '{WHISPER_MODEL_NAME}.pt' is available in '{WHISPER_DOWNLOAD_ROOT}' or that the application has internet access to download it.")
         whisper_model = None # Keep it as None, routes should check this
 
+# --- Whisper batching (see whisper_batcher.py) ---
+# Off by default. Batching only helps when several transcriptions run at once in the same worker,
+# so raise INFERENCE_MAX_PER_PROCESS (app.py) together with it.
+WHISPER_BATCHING = os.environ.get('WHISPER_BATCHING', '0') == '1'
+WHISPER_BATCH_MAX_SIZE = int(os.environ.get('WHISPER_BATCH_MAX_SIZE', 8)) # Windows per batched forward pass
+WHISPER_BATCH_MAX_WAIT_MS = int(os.environ.get('WHISPER_BATCH_MAX_WAIT_MS', 50)) # How long the first window waits for others
+WHISPER_BATCH_RESULT_TIMEOUT = int(os.environ.get('WHISPER_BATCH_RESULT_TIMEOUT', 300)) # Seconds to wait for one window
+
+# Every forward pass through whisper_model (transcribe, language detection, batched decode) holds this lock:
+# concurrent requests in one worker must not run the shared model at the same time.
+whisper_model_lock = threading.Lock()
+
+whisper_batcher = None
+if whisper_model and WHISPER_BATCHING:
+    # The batcher's thread starts on first use, i.e. inside the worker process that serves the request
+    whisper_batcher = WhisperBatcher(whisper_model, WHISPER_BATCH_MAX_SIZE, WHISPER_BATCH_MAX_WAIT_MS,
+                                     model_lock=whisper_model_lock, result_timeout=WHISPER_BATCH_RESULT_TIMEOUT)
+    print(f"Whisper batching enabled (max batch {WHISPER_BATCH_MAX_SIZE}, max wait {WHISPER_BATCH_MAX_WAIT_MS} ms)")
+
 # --- Vosk Model Configuration & Loading ---
 VOSK_MODELS_DIR = os.path.join(MODELS_BASE_DIR, 'vosk_models') # e.g., tts_stt_app/models/vosk_models
 if not os.path.exists(VOSK_MODELS_DIR):
@@ -56,6 +83,13 @@ if not os.path.exists(VOSK_MODELS_DIR):
 
 loaded_vosk_models = {} # Cache for loaded Vosk models: {'en-us': VoskModel_instance}
 
+def list_vosk_model_dirs():
+    """Names of the model directories installed in VOSK_MODELS_DIR (the only valid Vosk language choices)."""
+    try:
+        return sorted(d for d in os.listdir(VOSK_MODELS_DIR) if os.path.isdir(os.path.join(VOSK_MODELS_DIR, d)))
+    except FileNotFoundError:
+        return []
+
 def get_vosk_model(lang_code="en-us"):
     """Loads a Vosk model for the given language code. Assumes models are in VOSK_MODELS_DIR/model-<lang_code>"""
     if not VOSK_AVAILABLE:
@@ -70,7 +104,8 @@ def get_vosk_model(lang_code="en-us"):
     # For now, let's assume the directory is named e.g., 'en-us' inside VOSK_MODELS_DIR
     model_path = os.path.join(VOSK_MODELS_DIR, lang_code) # e.g., tts_stt_app/models/vosk_models/en-us
 
-    if not os.path.exists(model_path):
+    # lang_code comes from the client: only accept an installed model directory's name, never a path
+    if lang_code not in list_vosk_model_dirs():
         print(f"Vosk model for '{lang_code}' not found at {model_path}. Please download and place it there.")
         # Example: Download from https://alphacephei.com/vosk/models and extract to VOSK_MODELS_DIR/en-us
         return None
@@ -100,9 +135,6 @@ def ensure_user_text_dir(user_id):
         os.makedirs(text_dir)
     return text_dir
 
-# Need pydub for audio conversion for Vosk
-from pydub import AudioSegment
-
 def ensure_user_dir(base_folder_name, user_id): # More generic version
     # Path relative to the app's root directory (where app.py is)
     dir_path = os.path.join(current_app.root_path, 'static', base_folder_name, str(user_id))
@@ -110,70 +142,349 @@ def ensure_user_dir(base_folder_name, user_id): # More generic version
         os.makedirs(dir_path)
     return dir_path
 
-def transcribe_with_vosk(audio_filepath, lang_code="en-us"):
+def iter_vosk_segments(vosk_model_instance, audio):
+    """
+    Runs a DecodedAudio through Vosk, yielding (segment, progress) for each recognized utterance (every Result()).
+    segment has 'start', 'end' (seconds, from word times) and 'text'; progress is the fraction of the audio consumed.
+    """
+    # Vosk requires 16-bit mono PCM; the shared decode stage already produced it, so no re-decode or temporary WAV is needed.
+    rec = KaldiRecognizer(vosk_model_instance, audio.sample_rate)
+    rec.SetWords(True)
+
+    total_samples = max(len(audio.samples), 1)
+    consumed_samples = 0
+    for data in audio.iter_pcm_chunks(4000):
+        consumed_samples += len(data) // 2
+        if rec.AcceptWaveform(data):
+            segment = vosk_result_segment(rec.Result(), consumed_samples / audio.sample_rate)
+            if segment:
+                yield segment, consumed_samples / total_samples
+
+    segment = vosk_result_segment(rec.FinalResult(), audio.duration)
+    if segment:
+        yield segment, 1.0
+
+def vosk_result_segment(result_json, fallback_end):
+    """Turns a Vosk Result()/FinalResult() JSON string into a segment dict, or None if nothing was recognized."""
+    result_dict = json.loads(result_json)
+    text = result_dict.get('text', '').strip()
+    if not text:
+        return None
+    words = result_dict.get('result') or [] # Per-word timings (SetWords(True))
+    start = words[0]['start'] if words else fallback_end
+    end = words[-1]['end'] if words else fallback_end
+    return {'start': start, 'end': end, 'text': text}
+
+def transcribe_with_vosk(audio, lang_code="en-us"):
+    """Transcribes a DecodedAudio (see utils/audio_tools.py) with the Vosk model for lang_code. Returns (text, lang_code) or (None, error)."""
     vosk_model_instance = get_vosk_model(lang_code)
     if not vosk_model_instance:
         return None, f"Vosk model for '{lang_code}' not available or failed to load."
 
-    converted_wav_path = None # Define outside try block for cleanup
     try:
-        # Vosk requires WAV PCM 16-bit mono. Convert using pydub.
-        converted_wav_path = audio_filepath + "_vosk_mono.wav"
-
-        sound = AudioSegment.from_file(audio_filepath)
-        sound = sound.set_channels(1) # Mono
-        sound = sound.set_frame_rate(16000) # 16kHz is common for Vosk models
-        sound.export(converted_wav_path, format="wav")
-
-        wf = open(converted_wav_path, "rb")
-        # Use the model's sample rate if available, else default (16000)
-        sample_rate = sound.frame_rate # Or vosk_model_instance.sample_rate if model object exposes it
-        rec = KaldiRecognizer(vosk_model_instance, sample_rate)
-        rec.SetWords(True)
-
-        full_transcription_parts = []
-        while True:
-            data = wf.read(4000)
-            if len(data) == 0:
-                break
-            if rec.AcceptWaveform(data):
-                result_json = rec.Result()
-                result_dict = json.loads(result_json)
-                full_transcription_parts.append(result_dict.get('text', ''))
-
-        final_result_json = rec.FinalResult()
-        final_result_dict = json.loads(final_result_json)
-        full_transcription_parts.append(final_result_dict.get('text', ''))
-
-        wf.close()
-
-        final_text = " ".join(filter(None, full_transcription_parts)).strip()
+        full_transcription_parts = [segment['text'] for segment, _ in iter_vosk_segments(vosk_model_instance, audio)]
+        final_text = " ".join(full_transcription_parts).strip()
         # Language is known from lang_code for Vosk.
         return final_text, lang_code
 
     except Exception as e:
-        print(f"Error during Vosk transcription for {audio_filepath} with lang {lang_code}: {e}")
+        print(f"Error during Vosk transcription with lang {lang_code}: {e}")
         return None, str(e)
+
+def transcribe_with_whisper(audio, language=None):
+    """
+    Transcribes a DecodedAudio with Whisper, through the cross-request batcher when WHISPER_BATCHING is on.
+    Returns a whisper_model.transcribe()-style dict ('text', 'language', 'segments').
+    """
+    if whisper_batcher is None:
+        if audio.is_memory_mapped:
+            # A spilled recording is too large to convert to float32 in one piece: go window by window instead
+            if language is None:
+                language = detect_language_whisper(audio) # Once for the whole file, not per window
+            segments = [segment for segment, _ in iter_whisper_segments(audio, language)]
+            return {'text': ' '.join(segment['text'] for segment in segments if segment['text']),
+                    'language': language, 'segments': segments}
+        with whisper_model_lock:
+            return whisper_model.transcribe(audio.as_float32(), language=language)
+    if language is None:
+        # Detect once up front so every window of this file is decoded (and batched) with the same options
+        language = detect_language_whisper(audio)
+    return transcribe_batched(whisper_batcher, audio, language)
+
+# Streaming mode: Whisper runs window by window so segments can be sent while later windows are still being transcribed.
+# Each window gets the end of the previous window's text as its prompt, which keeps context across the cut.
+# The last segment of a window may be a word cut in half at the window edge, so (as transcribe() does with its own
+# 30 s windows) it is dropped and the next window starts where the last kept segment ended.
+STREAM_WINDOW_SECONDS = 30 # Whisper's native input length
+STREAM_PROMPT_CHARS = 200
+
+def iter_whisper_segments(audio, language):
+    """Yields (segment, progress) for a DecodedAudio, window by window. segment has 'start', 'end' (seconds) and 'text'."""
+    duration = audio.duration
+    if whisper_batcher is not None:
+        for segment in iter_batched_segments(whisper_batcher, audio, language):
+            yield segment, min(segment['end'] / duration, 1.0)
+        return
+
+    previous_text = None
+    window_start = 0.0
+    while window_start < duration:
+        window_end = min(window_start + STREAM_WINDOW_SECONDS, duration)
+        with whisper_model_lock:
+            result = whisper_model.transcribe(audio.as_float32(window_start, window_end), language=language,
+                                              initial_prompt=previous_text)
+        segments = result['segments']
+        next_start = window_end
+        if window_end < duration and len(segments) > 1:
+            segments = segments[:-1] # Re-transcribed whole at the start of the next window
+            next_start = min(max(window_start + segments[-1]['end'], window_start + 1.0), window_end) # Always advance
+        for segment in segments:
+            yield {'start': window_start + segment['start'], 'end': min(window_start + segment['end'], next_start),
+                   'text': segment['text'].strip()}, next_start / duration
+        previous_text = ' '.join(segment['text'].strip() for segment in segments)[-STREAM_PROMPT_CHARS:] or None
+        window_start = next_start
+
+# --- Automatic engine routing ('auto' engine) ---
+# Only the first few seconds of the decoded audio are run through Whisper's language detection.
+# If a Vosk model exists for the detected language the full file goes to Vosk (fast path),
+# otherwise it goes to Whisper with the detected language (skipping Whisper's own detection pass).
+AUTO_DETECT_SECONDS = 10
+
+def detect_language_whisper(audio):
+    """Runs Whisper language detection on the start of a DecodedAudio. Returns a Whisper language code such as 'en'."""
+    head = whisper.pad_or_trim(audio.as_float32(0, AUTO_DETECT_SECONDS))
+    mel = whisper.log_mel_spectrogram(head, n_mels=whisper_model.dims.n_mels).to(whisper_model.device)
+    with whisper_model_lock: # Also excludes the batcher thread's decode (see whisper_batcher.py)
+        _, probs = whisper_model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+def find_vosk_model_for_language(lang_code):
+    """Returns the name of a model directory in VOSK_MODELS_DIR for a Whisper language code (e.g. 'en' -> 'en-us'), or None."""
+    if not VOSK_AVAILABLE or not lang_code:
+        return None
+    lang_code = lang_code.lower()
+    for model_dir in list_vosk_model_dirs():
+        # Accept 'en', 'en-us', 'en_us' and also unrenamed names like 'vosk-model-small-en-us-0.15'
+        parts = model_dir.lower().replace('_', '-').split('-')
+        if parts[0] == lang_code or (parts[:2] == ['vosk', 'model'] and lang_code in parts[2:]):
+            return model_dir
+    return None
+
+def route_auto_engine(audio):
+    """Decides which engine should transcribe the DecodedAudio. Returns (engine, detected_language, vosk_model_dir)."""
+    detected_language = detect_language_whisper(audio)
+    vosk_model_dir = find_vosk_model_for_language(detected_language)
+    if vosk_model_dir and get_vosk_model(vosk_model_dir):
+        return 'vosk', detected_language, vosk_model_dir
+    return 'whisper', detected_language, None
+
+def segment_event(segment, progress, speech_map):
+    """Payload of a streamed 'segment' event: times against the original audio and percent complete."""
+    start, end = segment['start'], segment['end']
+    if speech_map:
+        start, end = speech_map.to_original(start), speech_map.to_original(end)
+    return {'start': round(start, 2), 'end': round(end, 2), 'text': segment['text'], 'percent': int(progress * 100)}
+
+def whisper_events(audio, language, speech_map, stream_segments):
+    """
+    Runs Whisper on a DecodedAudio (use with 'yield from'). When stream_segments is set, yields a 'segment' event
+    per segment as it completes. Returns a transcribe()-style dict whose segments are timed against audio.
+    """
+    if not stream_segments:
+        return transcribe_with_whisper(audio, language=language)
+    if language is None:
+        language = detect_language_whisper(audio) # Once for the whole file, not per window
+    segments = []
+    for segment, progress in iter_whisper_segments(audio, language):
+        segments.append(segment)
+        yield 'segment', segment_event(segment, progress, speech_map)
+    return {'text': ' '.join(segment['text'] for segment in segments if segment['text']),
+            'language': language, 'segments': segments}
+
+def vosk_events(audio, lang_code, speech_map, stream_segments):
+    """Like whisper_events(), for Vosk. Returns (text, lang_code) or (None, error) like transcribe_with_vosk()."""
+    if not stream_segments:
+        return transcribe_with_vosk(audio, lang_code)
+    vosk_model_instance = get_vosk_model(lang_code)
+    if not vosk_model_instance:
+        return None, f"Vosk model for '{lang_code}' not available or failed to load."
+    full_transcription_parts = []
+    try:
+        for segment, progress in iter_vosk_segments(vosk_model_instance, audio):
+            full_transcription_parts.append(segment['text'])
+            yield 'segment', segment_event(segment, progress, speech_map)
+    except Exception as e:
+        print(f"Error during Vosk transcription with lang {lang_code}: {e}")
+        return None, str(e)
+    return " ".join(full_transcription_parts).strip(), lang_code
+
+def iter_transcription(audio_path, stt_engine_choice, vosk_lang_choice, spill_dir, trim_silence_choice=False,
+                       stream_segments=False):
+    """
+    Decodes the audio file once, transcribes it with the chosen engine ('whisper', 'vosk' or 'auto'),
+    saves the .txt output and logs the conversion for current_user.
+    With trim_silence_choice, only the speech regions found by the VAD pre-pass (utils/vad_tools.py) reach the engine.
+
+    A generator of (event, payload) pairs, so the work can be reported while it runs:
+      ('status', message)   a stage has started (decoding, language detection, ...)
+      ('segment', payload)  stream_segments only: a transcribed piece, see segment_event()
+      ('reset', None)       segments sent so far are void (the auto engine fell back from Vosk to Whisper)
+    and finally exactly one ('result', result) or ('error', error_message); see run_transcription() for result.
+    With stream_segments, Whisper transcribes STREAM_WINDOW_SECONDS windows in turn instead of the whole file in one call.
+    The caller owns (and removes) audio_path.
+    """
+    transcribed_text = None
+    processed_language = "unknown" # Language used/detected by the engine
+    engine_label = stt_engine_choice # Engine recorded in the log (the 'auto' engine records where it routed)
+    error_message = None
+    original_audio = audio = None # Decoded once, shared by every engine below
+    speech_audio, speech_map = None, None # Silence-trimmed copy of audio and its timestamp map (trim_silence_choice only)
+    segments = []
+    engine_used, engine_model = None, None # Engine/model that actually produced the text (for metrics)
+
+    try:
+        processing_started = time.perf_counter() # Decode + VAD + inference time, excluding the upload itself
+        yield 'status', 'Decoding audio...'
+        original_audio = audio = decode_audio(audio_path, spill_dir=spill_dir)
+        if trim_silence_choice:
+            yield 'status', 'Finding speech...'
+            trimmed_audio, speech_map = trim_silence(original_audio, spill_dir=spill_dir)
+            if speech_map is not None: # None: too little silence to trim, or no speech detected
+                print(f"Silence trimming: {speech_map.skipped_seconds:.1f}s of {original_audio.duration:.1f}s skipped for {audio_path}")
+                speech_audio = audio = trimmed_audio # Engines below only see the speech regions
+
+        if stt_engine_choice == 'whisper':
+            if not whisper_model:
+                error_message = "Whisper STT engine is selected, but the model is not available. Please check server logs."
+            else:
+                print(f"Transcribing with Whisper: {audio_path}")
+                yield 'status', 'Transcribing with Whisper...'
+                result = yield from whisper_events(audio, None, speech_map, stream_segments)
+                transcribed_text = result["text"]
+                processed_language = result.get("language", "unknown")
+                segments = result.get("segments", [])
+                engine_used, engine_model = 'whisper', WHISPER_MODEL_NAME
+
+        elif stt_engine_choice == 'vosk':
+            if not VOSK_AVAILABLE:
+                error_message = "Vosk STT engine is selected, but the Vosk library is not installed/available."
+            elif not vosk_lang_choice:
+                error_message = "Vosk STT engine selected, but no Vosk language model was chosen or available."
+            else:
+                print(f"Transcribing with Vosk (lang: {vosk_lang_choice}): {audio_path}")
+                yield 'status', 'Transcribing with Vosk...'
+                transcribed_text, vosk_error_detail = yield from vosk_events(audio, vosk_lang_choice, speech_map, stream_segments)
+                if transcribed_text is None: # Transcription failed
+                    error_message = f"Vosk transcription failed: {vosk_error_detail}"
+                else:
+                    processed_language = vosk_lang_choice # For Vosk, language is the chosen model
+                    engine_used, engine_model = 'vosk', vosk_lang_choice
+
+        elif stt_engine_choice == 'auto':
+            if not whisper_model:
+                error_message = "Auto engine needs the Whisper model for language detection, but it is not available. Please check server logs."
+            else:
+                yield 'status', 'Detecting language...'
+                routed_engine, detected_language, vosk_model_dir = route_auto_engine(audio)
+                print(f"Auto engine: detected '{detected_language}', routing to {routed_engine}: {audio_path}")
+                yield 'status', f"Detected language '{detected_language}', transcribing with {routed_engine.capitalize()}..."
+                if routed_engine == 'vosk':
+                    transcribed_text, vosk_error_detail = yield from vosk_events(audio, vosk_model_dir, speech_map, stream_segments)
+                    if transcribed_text is None:
+                        # Fast path failed; fall back to Whisper rather than failing the request
+                        print(f"Auto engine: Vosk failed ({vosk_error_detail}), falling back to Whisper.")
+                        routed_engine = 'whisper'
+                        yield 'reset', None
+                        yield 'status', 'Vosk failed, transcribing with Whisper...'
+                    else:
+                        processed_language = vosk_model_dir
+                        engine_used, engine_model = 'vosk', vosk_model_dir
+                if routed_engine == 'whisper':
+                    # Language is already known, so Whisper does not run its own detection pass
+                    result = yield from whisper_events(audio, detected_language, speech_map, stream_segments)
+                    transcribed_text = result["text"]
+                    processed_language = result.get("language", detected_language)
+                    segments = result.get("segments", [])
+                    engine_used, engine_model = 'whisper', WHISPER_MODEL_NAME
+                # Record the routing decision, e.g. "auto->vosk: en-us" or "auto->whisper: fr"
+                engine_label = f"auto->{routed_engine}"
+        else:
+            error_message = "Invalid STT engine selected."
+
+        if error_message is None and transcribed_text is None: # Safeguard if error_message wasn't set but text is None
+            error_message = "STT process completed but failed to return text."
+
+        if error_message is None:
+            skipped_seconds = speech_map.skipped_seconds if speech_map else 0.0
+            if speech_map:
+                segments = speech_map.remap_segments(segments)
+
+            # Ensure user_text_dir uses the generic ensure_user_dir
+            user_text_output_dir = ensure_user_dir('text', current_user.id)
+            unique_id = uuid.uuid4().hex
+            # Include engine in filename for clarity
+            output_txt_filename = f"stt_{stt_engine_choice}_{processed_language.replace(' ','-')}_{unique_id}.txt"
+            output_txt_filepath = os.path.join(user_text_output_dir, output_txt_filename)
+
+            with open(output_txt_filepath, 'w', encoding='utf-8') as f:
+                f.write(transcribed_text)
+
+            new_log = ConversionLog(
+                user_id=current_user.id,
+                type='STT',
+                language=f"{engine_label}: {processed_language}",
+                output_filename=output_txt_filename,
+                engine=engine_used,
+                model=engine_model,
+                audio_duration=original_audio.duration, # Full recording, so skipped silence shows up as a lower RTF
+                processing_time=time.perf_counter() - processing_started,
+                output_bytes=os.path.getsize(output_txt_filepath),
+                vad_skipped_seconds=skipped_seconds if trim_silence_choice else None
+            )
+            db.session.add(new_log)
+            db.session.flush() # Assigns new_log.id for the search index
+            index_conversion(new_log, transcribed_text)
+            record_usage(new_log)
+            db.session.commit()
     finally:
-        if converted_wav_path and os.path.exists(converted_wav_path):
-            os.remove(converted_wav_path) # Clean up temporary converted WAV
+        # Releases the memory-mapped spill files for long recordings
+        if speech_audio is not None:
+            speech_audio.close()
+        if original_audio is not None:
+            original_audio.close()
+
+    if error_message:
+        yield 'error', error_message
+    else:
+        yield 'result', {'text': transcribed_text, 'txt_filename': output_txt_filename, 'engine_label': engine_label,
+                         'segments': segments, 'skipped_seconds': skipped_seconds}
+
+def run_transcription(audio_path, stt_engine_choice, vosk_lang_choice, spill_dir, trim_silence_choice=False):
+    """
+    Runs iter_transcription() to the end. Returns (result, None) on success, where result has 'text', 'txt_filename',
+    'engine_label', 'segments' (Whisper segments, timed against the original audio) and 'skipped_seconds';
+    or (None, error_message).
+    """
+    for event, payload in iter_transcription(audio_path, stt_engine_choice, vosk_lang_choice, spill_dir, trim_silence_choice):
+        if event == 'result':
+            return payload, None
+        if event == 'error':
+            return None, payload
 
 @stt_bp.route('/transcribe', methods=['GET', 'POST'])
 @login_required
+@inference_limited
 def transcribe():
     form = STTForm()
     text_form = STTTextForm()
 
     # Dynamically populate Vosk language choices based on found model directories
     if VOSK_AVAILABLE:
-        try:
-            available_vosk_model_dirs = [d for d in os.listdir(VOSK_MODELS_DIR) if os.path.isdir(os.path.join(VOSK_MODELS_DIR, d))]
-            form.vosk_language.choices = [(model_dir, model_dir.replace('-', ' ').replace('_', ' ').title()) for model_dir in available_vosk_model_dirs]
-            if not form.vosk_language.choices:
-                form.vosk_language.choices = [("", "No Vosk models found in models/vosk_models")]
-        except FileNotFoundError:
-            form.vosk_language.choices = [("", "Vosk models directory not found")]
-            print(f"Vosk models directory not found at {VOSK_MODELS_DIR}")
+        # Same list get_vosk_model() validates against, so every offered choice is accepted
+        available_vosk_model_dirs = list_vosk_model_dirs()
+        form.vosk_language.choices = [(model_dir, model_dir.replace('-', ' ').replace('_', ' ').title()) for model_dir in available_vosk_model_dirs]
+        if not form.vosk_language.choices:
+            form.vosk_language.choices = [("", "No Vosk models found in models/vosk_models")]
     else: # Vosk not available
         form.vosk_language.choices = [("", "Vosk not available")]
         # Hide Vosk engine choice if not available? Or let it show and error out.
@@ -187,6 +498,7 @@ def transcribe():
         file = request.files['audio_file']
         stt_engine_choice = form.stt_engine.data
         vosk_lang_choice = form.vosk_language.data
+        trim_silence_choice = form.trim_silence.data
 
         if file.filename == '':
             flash('No selected file.', 'warning')
@@ -197,70 +509,23 @@ def transcribe():
             user_temp_uploads_dir = ensure_user_dir('uploads', current_user.id) # Using the generic helper
             temp_audio_path = os.path.join(user_temp_uploads_dir, filename)
 
-            transcribed_text = None
-            processed_language = "unknown" # Language used/detected by the engine
-            error_message = None
-
             try:
                 file.save(temp_audio_path)
-
-                if stt_engine_choice == 'whisper':
-                    if not whisper_model:
-                        error_message = "Whisper STT engine is selected, but the model is not available. Please check server logs."
-                    else:
-                        print(f"Transcribing with Whisper: {temp_audio_path}")
-                        transcribe_options = {}
-                        result = whisper_model.transcribe(temp_audio_path, **transcribe_options)
-                        transcribed_text = result["text"]
-                        processed_language = result.get("language", "unknown")
-
-                elif stt_engine_choice == 'vosk':
-                    if not VOSK_AVAILABLE:
-                        error_message = "Vosk STT engine is selected, but the Vosk library is not installed/available."
-                    elif not vosk_lang_choice:
-                        error_message = "Vosk STT engine selected, but no Vosk language model was chosen or available."
-                    else:
-                        print(f"Transcribing with Vosk (lang: {vosk_lang_choice}): {temp_audio_path}")
-                        transcribed_text, vosk_error_detail = transcribe_with_vosk(temp_audio_path, vosk_lang_choice)
-                        if transcribed_text is None: # Transcription failed
-                            error_message = f"Vosk transcription failed: {vosk_error_detail}"
-                        else:
-                            processed_language = vosk_lang_choice # For Vosk, language is the chosen model
-                else:
-                    error_message = "Invalid STT engine selected."
+                result, error_message = run_transcription(temp_audio_path, stt_engine_choice, vosk_lang_choice, user_temp_uploads_dir,
+                                                          trim_silence_choice)
 
                 if error_message:
                     flash(error_message, "danger")
                     print(f"STT Error: {error_message}")
-                elif transcribed_text is None: # Safeguard if error_message wasn't set but text is None
-                    flash("STT process completed but failed to return text.", "danger")
-                    print("STT Error: Transcribed text is None without specific error message.")
                 else: # Success
-                    # Ensure user_text_dir uses the generic ensure_user_dir
-                    user_text_output_dir = ensure_user_dir('text', current_user.id)
-                    unique_id = uuid.uuid4().hex
-                    # Include engine in filename for clarity
-                    output_txt_filename = f"stt_{stt_engine_choice}_{processed_language.replace(' ','-')}_{unique_id}.txt"
-                    output_txt_filepath = os.path.join(user_text_output_dir, output_txt_filename)
-
-                    with open(output_txt_filepath, 'w', encoding='utf-8') as f:
-                        f.write(transcribed_text)
-
-                    new_log = ConversionLog(
-                        user_id=current_user.id,
-                        type='STT',
-                        language=f"{stt_engine_choice}: {processed_language}",
-                        output_filename=output_txt_filename
-                    )
-                    db.session.add(new_log)
-                    db.session.commit()
-
-                    flash(f'Audio transcribed successfully with {stt_engine_choice.capitalize()}!', 'success')
-                    text_form.transcribed_text.data = transcribed_text
+                    flash(f'Audio transcribed successfully with {result["engine_label"].capitalize()}!', 'success')
+                    if trim_silence_choice:
+                        flash(f'Silence trimming skipped {result["skipped_seconds"]:.1f} seconds of audio.', 'info')
+                    text_form.transcribed_text.data = result['text']
 
                     return render_template('stt_transcriber.html', form=form, text_form=text_form,
-                                           txt_filename=output_txt_filename,
-                                           pdf_filename=output_txt_filename.replace('.txt','.pdf'),
+                                           txt_filename=result['txt_filename'],
+                                           pdf_filename=result['txt_filename'].replace('.txt','.pdf'),
                                            result_text_available=True)
 
             except Exception as e:
@@ -275,6 +540,276 @@ def transcribe():
     return render_template('stt_transcriber.html', form=form, text_form=text_form, txt_filename=None, pdf_filename=None, result_text_available=False)
 
 
+# --- Resumable chunked uploads ---
+# Protocol (JSON API used by stt_transcriber.html for large files):
+#   POST   /stt/uploads                  {filename, size, stt_engine, vosk_language, trim_silence} -> {upload_id, offset, chunk_size}
+#   GET    /stt/uploads/<id>             -> {offset, size, chunk_size}  (where to resume after a disconnect)
+#   PUT    /stt/uploads/<id>             raw chunk body; headers Upload-Offset and optional X-Chunk-SHA256 -> {offset}
+#   POST   /stt/uploads/<id>/complete    transcribes the assembled file -> {text, txt_url, pdf_url, engine, skipped_seconds}
+#   POST   /stt/uploads/<id>/stream      same, as a text/event-stream of progress and segments (see stream_upload)
+#   DELETE /stt/uploads/<id>             abandons the upload
+# Chunks are streamed from the request body straight onto the end of a .part file; a chunk whose checksum does not
+# match is truncated away again. Sessions with no activity for UPLOAD_SESSION_TTL are expired.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024 # Suggested to clients
+UPLOAD_MAX_CHUNK_BYTES = 16 * 1024 * 1024
+UPLOAD_MAX_FILE_BYTES = 2 * 1024 * 1024 * 1024
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+UPLOAD_CLEANUP_INTERVAL = 60 * 60 # Seconds between expiry runs (see init_upload_cleanup)
+UPLOAD_STREAM_BLOCK_BYTES = 64 * 1024
+
+def upload_part_path(upload_session):
+    return os.path.join(ensure_user_dir('uploads', upload_session.user_id), f"{upload_session.id}.part")
+
+def expire_upload_sessions():
+    """Deletes upload sessions (and their .part files) that have been idle longer than UPLOAD_SESSION_TTL."""
+    expired_sessions = UploadSession.query.filter(UploadSession.updated_at < datetime.utcnow() - UPLOAD_SESSION_TTL).all()
+    for upload_session in expired_sessions:
+        part_path = upload_part_path(upload_session)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        db.session.delete(upload_session)
+    if expired_sessions:
+        db.session.commit()
+        print(f"Expired {len(expired_sessions)} abandoned upload sessions.")
+
+def init_upload_cleanup(app):
+    """Expires abandoned uploads at startup and then every UPLOAD_CLEANUP_INTERVAL, so an idle server still frees their disk space."""
+    def cleanup_once():
+        with app.app_context():
+            try:
+                expire_upload_sessions()
+            except Exception as e: # e.g. another worker removed the same sessions first; the next run catches up
+                db.session.rollback()
+                print(f"Upload cleanup failed: {e}")
+
+    def cleanup_loop():
+        while True:
+            time.sleep(UPLOAD_CLEANUP_INTERVAL)
+            cleanup_once()
+
+    cleanup_once()
+    threading.Thread(target=cleanup_loop, name='upload-cleanup', daemon=True).start()
+
+def get_user_upload_session(upload_id):
+    upload_session = UploadSession.query.get(upload_id)
+    if upload_session is None or upload_session.user_id != current_user.id:
+        return None
+    return upload_session
+
+def upload_error(message, status, upload_session=None):
+    body = {'error': message}
+    if upload_session is not None:
+        body['offset'] = upload_session.received_bytes
+    return jsonify(body), status
+
+@stt_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    expire_upload_sessions()
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    total_size = data.get('size')
+    stt_engine_choice = data.get('stt_engine') or 'whisper'
+
+    if not filename or not allowed_file(filename):
+        return upload_error(f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}', 400)
+    if not isinstance(total_size, int) or total_size <= 0 or total_size > UPLOAD_MAX_FILE_BYTES:
+        return upload_error(f'File size must be between 1 byte and {UPLOAD_MAX_FILE_BYTES} bytes.', 400)
+    if stt_engine_choice not in ('whisper', 'vosk', 'auto'):
+        return upload_error('Invalid STT engine selected.', 400)
+    vosk_lang_choice = (data.get('vosk_language') or None) if stt_engine_choice == 'vosk' else None
+    if stt_engine_choice == 'vosk' and vosk_lang_choice not in list_vosk_model_dirs():
+        return upload_error('Unknown Vosk language model.', 400)
+
+    upload_session = UploadSession(id=uuid.uuid4().hex, user_id=current_user.id, filename=filename, total_size=total_size,
+                                   stt_engine=stt_engine_choice, vosk_language=vosk_lang_choice,
+                                   trim_silence=bool(data.get('trim_silence')))
+    db.session.add(upload_session)
+    db.session.commit()
+    open(upload_part_path(upload_session), 'wb').close()
+    return jsonify({'upload_id': upload_session.id, 'offset': 0, 'chunk_size': UPLOAD_CHUNK_SIZE}), 201
+
+@stt_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload_session = get_user_upload_session(upload_id)
+    if upload_session is None:
+        return upload_error('Upload not found or expired.', 404)
+    return jsonify({'offset': upload_session.received_bytes, 'size': upload_session.total_size,
+                    'chunk_size': UPLOAD_CHUNK_SIZE})
+
+@stt_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    upload_session = get_user_upload_session(upload_id)
+    if upload_session is None:
+        return upload_error('Upload not found or expired.', 404)
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset != upload_session.received_bytes:
+        # Client is out of sync (e.g. a retried chunk that had already landed); tell it where to resume
+        return upload_error('Upload-Offset does not match the bytes received so far.', 409, upload_session)
+    chunk_length = request.content_length
+    if chunk_length is None or chunk_length <= 0 or chunk_length > UPLOAD_MAX_CHUNK_BYTES:
+        return upload_error(f'Chunks must have a Content-Length between 1 and {UPLOAD_MAX_CHUNK_BYTES} bytes.', 413, upload_session)
+    if offset + chunk_length > upload_session.total_size:
+        return upload_error('Chunk extends past the declared file size.', 400, upload_session)
+
+    part_path = upload_part_path(upload_session)
+    expected_checksum = (request.headers.get('X-Chunk-SHA256') or '').lower()
+    checksum = hashlib.sha256()
+    written = 0
+    with open(part_path, 'r+b') as part_file:
+        part_file.seek(offset)
+        part_file.truncate() # Drop any partial bytes left by an interrupted earlier attempt
+        while True:
+            block = request.stream.read(UPLOAD_STREAM_BLOCK_BYTES)
+            if not block:
+                break
+            part_file.write(block)
+            checksum.update(block)
+            written += len(block)
+        if written != chunk_length or (expected_checksum and checksum.hexdigest() != expected_checksum):
+            part_file.truncate(offset)
+            return upload_error('Chunk was incomplete or failed checksum verification; resend it.', 422, upload_session)
+
+    upload_session.received_bytes = offset + written
+    upload_session.updated_at = datetime.utcnow()
+    db.session.commit()
+    return jsonify({'offset': upload_session.received_bytes, 'size': upload_session.total_size,
+                    'chunk_size': UPLOAD_CHUNK_SIZE})
+
+@stt_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    upload_session = get_user_upload_session(upload_id)
+    if upload_session is None:
+        return upload_error('Upload not found or expired.', 404)
+    part_path = upload_part_path(upload_session)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    db.session.delete(upload_session)
+    db.session.commit()
+    return '', 204
+
+def claim_completed_upload(upload_id):
+    """
+    Turns a fully received upload into a transcription job: gives the assembled file its real extension (so ffmpeg can
+    probe it as usual) and deletes the session, so the same upload cannot be transcribed twice.
+    Returns (job, None), or (None, error_response).
+    """
+    upload_session = get_user_upload_session(upload_id)
+    if upload_session is None:
+        return None, upload_error('Upload not found or expired.', 404)
+    if upload_session.received_bytes != upload_session.total_size:
+        return None, upload_error('Upload is not complete yet.', 409, upload_session)
+
+    part_path = upload_part_path(upload_session)
+    audio_path = f"{part_path[:-len('.part')]}_{upload_session.filename}"
+    job = {'audio_path': audio_path, 'stt_engine': upload_session.stt_engine,
+           'vosk_language': upload_session.vosk_language, 'trim_silence': bool(upload_session.trim_silence)}
+    # Claim the session before touching the file: of two concurrent /complete calls only one deletes the row
+    deleted = UploadSession.query.filter_by(id=upload_session.id).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted != 1:
+        return None, upload_error('Upload not found or expired.', 404)
+    try:
+        os.replace(part_path, audio_path)
+    except FileNotFoundError: # Removed by the expiry timer or a cancel in between
+        return None, upload_error('Upload not found or expired.', 404)
+    return job, None
+
+def transcription_urls(result):
+    return {
+        'txt_url': url_for('stt.download_stt_text', type='txt', filename=result['txt_filename']),
+        'pdf_url': url_for('stt.download_stt_text', type='pdf', filename=result['txt_filename']),
+    }
+
+@stt_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+@inference_limited
+def complete_upload(upload_id):
+    job, error_response = claim_completed_upload(upload_id)
+    if error_response is not None:
+        return error_response
+    audio_path = job['audio_path']
+
+    try:
+        result, error_message = run_transcription(audio_path, job['stt_engine'], job['vosk_language'], os.path.dirname(audio_path),
+                                                  job['trim_silence'])
+    except Exception as e:
+        print(f"STT General Error (chunked upload): {e}")
+        return upload_error(f"An unexpected error occurred during STT processing: {str(e)}", 500)
+    finally:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+
+    if error_message:
+        print(f"STT Error: {error_message}")
+        return upload_error(error_message, 422)
+    return jsonify(dict(text=result['text'], engine=result['engine_label'], skipped_seconds=result['skipped_seconds'],
+                        **transcription_urls(result)))
+
+def sse_event(event, data):
+    """Formats one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@stt_bp.route('/uploads/<upload_id>/stream', methods=['POST'])
+@login_required
+def stream_upload(upload_id):
+    """
+    Same job as complete_upload(), but the response is a text/event-stream that reports progress while it runs:
+      status  {message}                          a stage has started
+      segment {start, end, text, percent}        a Whisper segment or Vosk Result(), times against the original audio
+      reset   {}                                 discard the segments received so far (auto engine fell back to Whisper)
+      done    {text, engine, skipped_seconds, txt_url, pdf_url}   the .txt and ConversionLog have been saved
+      error   {error}
+    It is a POST (read with fetch, not EventSource) so it carries the CSRF token like the other upload calls.
+    """
+    # The inference slot must outlive this function (the work happens while the response streams), so it is taken
+    # here instead of with @inference_limited and released when the response is closed.
+    admission = get_admission()
+    slot = admission.acquire()
+    if slot is None:
+        print(f"Admission control: rejected {request.path} (server saturated)")
+        return admission.busy_response()
+    job, error_response = claim_completed_upload(upload_id)
+    if error_response is not None:
+        admission.release(slot)
+        return error_response
+    audio_path = job['audio_path']
+
+    def generate():
+        try:
+            for event, payload in iter_transcription(audio_path, job['stt_engine'], job['vosk_language'], os.path.dirname(audio_path),
+                                                     job['trim_silence'], stream_segments=True):
+                if event == 'status':
+                    yield sse_event('status', {'message': payload})
+                elif event == 'segment':
+                    yield sse_event('segment', payload)
+                elif event == 'reset':
+                    yield sse_event('reset', {})
+                elif event == 'result':
+                    yield sse_event('done', dict(text=payload['text'], engine=payload['engine_label'],
+                                                 skipped_seconds=payload['skipped_seconds'], **transcription_urls(payload)))
+                else:
+                    print(f"STT Error: {payload}")
+                    yield sse_event('error', {'error': payload})
+        except Exception as e:
+            print(f"STT General Error (streamed): {e}")
+            yield sse_event('error', {'error': f"An unexpected error occurred during STT processing: {str(e)}"})
+
+    def cleanup():
+        # Runs after the stream finishes or the client disconnects (the generator is closed first)
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        admission.release(slot)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # No proxy buffering
+    response.call_on_close(cleanup)
+    return response
+
 @stt_bp.route('/download_text/<type>/<filename>')
 @login_required
 def download_stt_text(type, filename):
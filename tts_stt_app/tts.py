@@ -1,12 +1,15 @@
 import os
 import pyttsx3
-from flask import Blueprint, render_template, request, send_from_directory, flash, redirect, url_for
+from flask import Blueprint, render_template, request, send_from_directory, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
 from .forms import TTSForm
-from .models import db, ConversionLog
+from .models import db, ConversionLog, record_usage
+from .search import index_conversion
+from .admission import inference_limited
 from datetime import datetime
 import uuid # For generating unique filenames
-from pydub import AudioSegment
+import time
+from .utils.audio_tools import OUTPUT_FORMATS, encode_audio, probe_duration
 
 tts_bp = Blueprint('tts', __name__, url_prefix='/tts')
 
@@ -19,6 +22,7 @@ def ensure_user_audio_dir(user_id):
 
 @tts_bp.route('/convert', methods=['GET', 'POST'])
 @login_required
+@inference_limited
 def convert():
     form = TTSForm()
     output_filename = None
@@ -35,16 +39,27 @@ def convert():
 
             user_audio_dir = ensure_user_audio_dir(current_user.id)
             unique_id = uuid.uuid4().hex
-            temp_wav_filename = f"tts_output_{unique_id}.wav" # eSpeak outputs WAV
+            # Engine WAV: only written by pyttsx3 (file output only) and as the fallback output. Its name differs from
+            # encoded_filename even when WAV is requested, since ffmpeg cannot use one file as both input and output.
+            temp_wav_filename = f"tts_engine_{unique_id}.wav"
             temp_wav_filepath = os.path.join(user_audio_dir, temp_wav_filename)
-            output_mp3_filename = f"tts_output_{unique_id}.mp3"
-            output_mp3_filepath = os.path.join(user_audio_dir, output_mp3_filename)
 
-            espeak_success = False
+            # Output format/bitrate: per request, else the server default
+            output_format = form.output_format.data or current_app.config.get('TTS_DEFAULT_FORMAT', 'mp3')
+            if output_format not in OUTPUT_FORMATS:
+                output_format = 'mp3'
+            output_bitrate = form.bitrate.data or current_app.config.get('TTS_DEFAULT_BITRATE') or None
+            encoded_filename = f"tts_output_{unique_id}.{OUTPUT_FORMATS[output_format]['extension']}"
+            encoded_filepath = os.path.join(user_audio_dir, encoded_filename)
+
             tts_engine_choice = form.tts_engine.data
             # festival_voice_choice = form.festival_voice.data # If Festival voice selection is added
 
-            wav_generated_by_engine = False
+            # WAV produced by the engine: bytes read from its stdout (eSpeak, Festival) or a file path (pyttsx3).
+            # It goes straight to the encoder; there is no intermediate load-and-export step.
+            engine_output = None
+            engine_model = language # Voice used, for metrics; pyttsx3 replaces it with the system voice it picked
+            processing_started = time.perf_counter()
 
             if tts_engine_choice == 'espeak':
                 try:
@@ -56,10 +71,9 @@ def convert():
                         raise NotImplementedError("eSpeak not available")
 
                     espeak_lang_option = language
-                    command = ['espeak', '-v', espeak_lang_option, '-w', temp_wav_filepath, text_to_convert]
-                    subprocess.run(command, check=True, capture_output=True, text=True)
-                    wav_generated_by_engine = True
-                    print(f"eSpeak generated WAV: {temp_wav_filepath}")
+                    command = ['espeak', '-v', espeak_lang_option, '--stdout', text_to_convert]
+                    engine_output = subprocess.run(command, check=True, capture_output=True).stdout
+                    print(f"eSpeak generated {len(engine_output)} bytes of WAV")
                 except (NotImplementedError, subprocess.CalledProcessError, FileNotFoundError) as e_espeak:
                     flash(f"eSpeak processing failed: {e_espeak}. Try another engine.", "danger")
                     print(f"eSpeak processing error: {e_espeak}")
@@ -85,16 +99,15 @@ def convert():
                     # It will use its default voice.
 
                     # Using text2wave: text2wave [options] textfile -o output.wav
-                    # We need to pass text via stdin or a temporary file. Stdin is cleaner.
+                    # Text goes in via stdin; without -o the WAV is written to stdout.
                     process = subprocess.run(
-                        ['text2wave', '-o', temp_wav_filepath],
-                        input=text_to_convert,
-                        text=True,
+                        ['text2wave'],
+                        input=text_to_convert.encode('utf-8'),
                         check=True,
                         capture_output=True
                     )
-                    wav_generated_by_engine = True
-                    print(f"Festival generated WAV: {temp_wav_filepath}")
+                    engine_output = process.stdout
+                    print(f"Festival generated {len(engine_output)} bytes of WAV")
                 except (NotImplementedError, subprocess.CalledProcessError, FileNotFoundError) as e_festival:
                     flash(f"Festival processing failed: {e_festival}. Try another engine.", "danger")
                     print(f"Festival processing error: {e_festival}")
@@ -108,12 +121,15 @@ def convert():
                         if language in voice.languages or language == voice.id.split('_')[-1]:
                             selected_voice = voice.id
                             break
-                    if selected_voice: engine.setProperty('voice', selected_voice)
+                    if selected_voice:
+                        engine.setProperty('voice', selected_voice)
+                        engine_model = selected_voice
                     else: print(f"pyttsx3: No specific voice for '{language}', using default.")
 
                     engine.save_to_file(text_to_convert, temp_wav_filepath)
                     engine.runAndWait()
-                    wav_generated_by_engine = True
+                    if os.path.exists(temp_wav_filepath):
+                        engine_output = temp_wav_filepath
                     print(f"pyttsx3 generated WAV: {temp_wav_filepath}")
                 except Exception as e_pyttsx3:
                     flash(f"pyttsx3 processing failed: {str(e_pyttsx3)}. Try another engine.", 'danger')
@@ -124,24 +140,27 @@ def convert():
 
 
             # If WAV generation was successful by any engine
-            if wav_generated_by_engine and os.path.exists(temp_wav_filepath):
+            if engine_output:
+                format_label = OUTPUT_FORMATS[output_format]['label']
                 try:
-                    audio = AudioSegment.from_wav(temp_wav_filepath)
-                    audio.export(output_mp3_filepath, format="mp3")
-                    os.remove(temp_wav_filepath)
-                    output_filename = output_mp3_filename
+                    encode_audio(engine_output, encoded_filepath, output_format, output_bitrate)
+                    output_filename = encoded_filename
                     output_filepath_relative = os.path.join('audio', str(current_user.id), output_filename)
-                    flash('Text converted to MP3 successfully!', 'success')
+                    flash(f'Text converted to {format_label} successfully!', 'success')
                 except Exception as e_conv:
-                    flash(f"Error converting WAV to MP3: {str(e_conv)}. Serving WAV instead (if available).", 'warning')
-                    print(f"MP3 Conversion Error: {e_conv}")
-                    # Fallback to WAV if MP3 conversion fails but WAV exists
-                    if os.path.exists(temp_wav_filepath): # Should not happen if successfully removed
-                        output_filename = temp_wav_filename
-                        output_filepath_relative = os.path.join('audio', str(current_user.id), output_filename)
-                    else: # This case means WAV was made, MP3 failed, and WAV somehow vanished. Unlikely.
-                         flash("Critical error in audio file handling after conversion attempt.", "danger")
-                         return render_template('tts_player.html', form=form, audio_file_url=None, filename=None)
+                    flash(f"Error encoding {format_label}: {str(e_conv)}. Serving WAV instead.", 'warning')
+                    print(f"{format_label} Encoding Error: {e_conv}")
+                    # Fallback to the engine's WAV as-is
+                    if isinstance(engine_output, bytes):
+                        with open(temp_wav_filepath, 'wb') as f:
+                            f.write(engine_output)
+                    output_format = 'wav'
+                    output_filename = temp_wav_filename
+                    output_filepath_relative = os.path.join('audio', str(current_user.id), output_filename)
+                finally:
+                    # pyttsx3's temporary WAV is no longer needed unless it is the fallback output
+                    if output_filename != temp_wav_filename and os.path.exists(temp_wav_filepath):
+                        os.remove(temp_wav_filepath)
             else:
                 flash("TTS WAV file generation failed.", "danger")
                 return render_template('tts_player.html', form=form, audio_file_url=None, filename=None)
@@ -158,14 +177,25 @@ def convert():
                 type='TTS',
                 language=f"{tts_engine_choice}:{language}", # Store engine and language
                 input_text=text_to_convert,
-                output_filename=output_filename # Store relative path from static/
+                output_filename=output_filename, # Store relative path from static/
+                output_format=output_format,
+                engine=tts_engine_choice,
+                model=engine_model,
+                processing_time=time.perf_counter() - processing_started,
             )
+            output_filepath = os.path.join(user_audio_dir, output_filename)
+            new_log.audio_duration = probe_duration(output_filepath)
+            new_log.output_bytes = os.path.getsize(output_filepath)
             db.session.add(new_log)
+            db.session.flush() # Assigns new_log.id for the search index
+            index_conversion(new_log, text_to_convert)
+            record_usage(new_log)
             db.session.commit()
 
             flash('Text converted to speech successfully!', 'success')
             # Pass the relative path for use in url_for('static', ...)
-            return render_template('tts_player.html', form=form, audio_file_url=url_for('static', filename=output_filepath_relative), filename=output_filename)
+            return render_template('tts_player.html', form=form, audio_file_url=url_for('static', filename=output_filepath_relative), filename=output_filename,
+                                   audio_mimetype=OUTPUT_FORMATS[output_format]['mimetype'])
 
         except Exception as e:
             flash(f"Error during TTS conversion: {str(e)}", 'danger')
@@ -182,12 +212,16 @@ def download_tts_audio(filename):
     if not os.path.exists(os.path.join(user_audio_dir, filename)):
          flash("File not found or access denied.", "danger")
          return redirect(url_for('tts.convert'))
-    return send_from_directory(user_audio_dir, filename, as_attachment=True)
+    # Serve the MIME type of the format recorded at conversion time (older logs have no format and fall back to the extension)
+    log_entry = ConversionLog.query.filter_by(user_id=current_user.id, type='TTS', output_filename=filename).first()
+    output_format = log_entry.output_format if log_entry and log_entry.output_format else filename.rsplit('.', 1)[-1].lower()
+    mimetype = OUTPUT_FORMATS[output_format]['mimetype'] if output_format in OUTPUT_FORMATS else None
+    return send_from_directory(user_audio_dir, filename, as_attachment=True, mimetype=mimetype)
 
 # Need a template for TTS interaction and player
 # templates/tts_player.html
 # This will be created in the next step.
 
 # Need to update app.py to register this blueprint
-# And requirements.txt for pyttsx3, pydub
-# And install ffmpeg for pydub MP3 export. Instructions for this will be in README.md.
+# And requirements.txt for pyttsx3
+# And install ffmpeg, which encodes the MP3/Opus output (see encode_audio). Instructions for this will be in README.md.
@@ -0,0 +1,165 @@
+import os
+import subprocess
+import tempfile
+import numpy as np
+
+# All STT engines work on 16 kHz mono audio, so every upload is decoded exactly once into this format
+# and the same buffer is handed to Whisper (as float32), Vosk (as PCM bytes) and any later stage.
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2 # 16-bit PCM
+
+# Recordings longer than this are spilled to a temporary file and memory-mapped instead of held in RAM.
+# 30 minutes of 16 kHz int16 audio is about 58 MB.
+MAX_IN_MEMORY_SECONDS = 30 * 60
+READ_BLOCK_BYTES = 1024 * 1024
+STDERR_TAIL_BYTES = 2000 # Part of ffmpeg's error output kept for the error message
+
+
+class DecodedAudio:
+    """
+    An upload decoded to 16 kHz mono 16-bit PCM.
+    samples: int16 numpy array (a read-only np.memmap when the recording was spilled to disk).
+    Call close() (or use as a context manager) to release the memory map and delete the spill file.
+    """
+    def __init__(self, samples, sample_rate=SAMPLE_RATE, spill_path=None):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.spill_path = spill_path
+
+    @property
+    def duration(self):
+        """Length of the audio in seconds."""
+        return len(self.samples) / float(self.sample_rate)
+
+    @property
+    def is_memory_mapped(self):
+        return self.spill_path is not None
+
+    def as_float32(self, start_seconds=0, end_seconds=None):
+        """Returns float32 samples in [-1, 1], the input format of whisper_model.transcribe()/log_mel_spectrogram()."""
+        start = int(start_seconds * self.sample_rate)
+        end = None if end_seconds is None else int(end_seconds * self.sample_rate)
+        return self.samples[start:end].astype(np.float32) / 32768.0
+
+    def iter_pcm_chunks(self, chunk_bytes=4000):
+        """Yields little-endian 16-bit PCM byte chunks, the input format of KaldiRecognizer.AcceptWaveform()."""
+        chunk_samples = max(1, chunk_bytes // BYTES_PER_SAMPLE)
+        for start in range(0, len(self.samples), chunk_samples):
+            yield self.samples[start:start + chunk_samples].tobytes()
+
+    def close(self):
+        if self.spill_path:
+            # Drop the memory map before removing the file (required on Windows)
+            self.samples = np.zeros(0, dtype=np.int16)
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            self.spill_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def decode_audio(audio_filepath, sample_rate=SAMPLE_RATE, max_in_memory_seconds=MAX_IN_MEMORY_SECONDS, spill_dir=None):
+    """
+    Decodes any ffmpeg-readable audio file once into a DecodedAudio (16 kHz mono int16).
+    ffmpeg's output is streamed; if it grows past max_in_memory_seconds it is written to a temporary
+    .pcm file in spill_dir and memory-mapped, so very long recordings do not have to fit in RAM.
+    Raises RuntimeError if ffmpeg fails.
+    """
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '0', '-i', audio_filepath,
+               '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-']
+    max_in_memory_bytes = int(max_in_memory_seconds * sample_rate * BYTES_PER_SAMPLE)
+
+    buffer = bytearray()
+    spill_file = None
+    # stderr goes to a file, not a pipe: a damaged input can log more than a pipe buffer holds, and ffmpeg would then
+    # block writing errors while we block reading stdout
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+    try:
+        while True:
+            block = process.stdout.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            if spill_file is not None:
+                spill_file.write(block)
+                continue
+            buffer.extend(block)
+            if len(buffer) > max_in_memory_bytes:
+                spill_file = tempfile.NamedTemporaryFile(prefix='decoded_', suffix='.pcm', dir=spill_dir, delete=False)
+                spill_file.write(buffer)
+                buffer = bytearray()
+        if process.wait() != 0:
+            stderr_file.seek(max(stderr_file.seek(0, os.SEEK_END) - STDERR_TAIL_BYTES, 0))
+            stderr = stderr_file.read() # Only the last errors; a damaged file can log a great deal
+            raise RuntimeError(f"Failed to decode audio {audio_filepath}: {stderr.decode(errors='ignore').strip()}")
+    except BaseException:
+        process.kill()
+        process.wait() # Reap the killed ffmpeg
+        if spill_file is not None:
+            spill_file.close()
+            os.remove(spill_file.name)
+        raise
+    finally:
+        process.stdout.close()
+        stderr_file.close()
+
+    if spill_file is None:
+        # Odd trailing byte cannot happen with s16le output, but keep frombuffer safe anyway
+        usable = len(buffer) - (len(buffer) % BYTES_PER_SAMPLE)
+        return DecodedAudio(np.frombuffer(buffer, dtype=np.int16, count=usable // BYTES_PER_SAMPLE), sample_rate)
+
+    spill_file.close()
+    if os.path.getsize(spill_file.name) < BYTES_PER_SAMPLE:
+        os.remove(spill_file.name)
+        return DecodedAudio(np.zeros(0, dtype=np.int16), sample_rate)
+    samples = np.memmap(spill_file.name, dtype=np.int16, mode='r')
+    print(f"Decoded audio for {audio_filepath} spilled to memory-mapped file {spill_file.name} ({len(samples) / sample_rate:.0f}s)")
+    return DecodedAudio(samples, sample_rate, spill_path=spill_file.name)
+
+
+# --- Output encoding (TTS) ---
+# Speech is mono and narrow-band, so low bitrates are enough; Opus in particular stays intelligible at 16-24 kbps.
+OUTPUT_FORMATS = {
+    'ogg': {'label': 'Opus/OGG', 'extension': 'ogg', 'mimetype': 'audio/ogg', 'codec': 'libopus', 'default_bitrate': '24k'},
+    'mp3': {'label': 'MP3', 'extension': 'mp3', 'mimetype': 'audio/mpeg', 'codec': 'libmp3lame', 'default_bitrate': '64k'},
+    'wav': {'label': 'WAV', 'extension': 'wav', 'mimetype': 'audio/wav', 'codec': 'pcm_s16le', 'default_bitrate': None},
+}
+BITRATE_CHOICES = ['16k', '24k', '32k', '48k', '64k', '96k', '128k']
+
+
+def encode_audio(source, output_filepath, output_format, bitrate=None):
+    """
+    Encodes engine output to output_format in a single ffmpeg pass.
+    source: WAV/PCM bytes (e.g. an engine's stdout, piped to ffmpeg's stdin) or a path to a WAV file.
+    bitrate: e.g. '24k'; defaults to the format's default_bitrate. Ignored for WAV.
+    Raises RuntimeError if ffmpeg fails.
+    """
+    format_info = OUTPUT_FORMATS[output_format]
+    from_bytes = isinstance(source, (bytes, bytearray))
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', 'pipe:0' if from_bytes else source,
+               '-ac', '1', '-c:a', format_info['codec']]
+    bitrate = bitrate or format_info['default_bitrate']
+    if format_info['default_bitrate'] and bitrate:
+        command += ['-b:a', bitrate]
+    if output_format == 'ogg':
+        command += ['-application', 'voip'] # Opus mode tuned for speech
+    command.append(output_filepath)
+
+    result = subprocess.run(command, input=source if from_bytes else None, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to encode {output_format}: {result.stderr.decode(errors='ignore').strip()}")
+    return output_filepath
+
+
+def probe_duration(audio_filepath):
+    """Returns the duration of an audio file in seconds (via ffprobe), or None if it cannot be determined."""
+    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', audio_filepath]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
@@ -0,0 +1,96 @@
+import os
+import csv
+import io
+import threading
+import zipfile
+
+# Outputs that are already compressed are stored as-is in export ZIPs; deflating them again only costs CPU.
+COMPRESSED_EXTENSIONS = {'.mp3', '.ogg', '.opus', '.m4a', '.aac', '.flac', '.pdf'}
+ZIP_BLOCK_BYTES = 64 * 1024
+
+
+def conversion_file_paths(root_path, log):
+    """Returns the on-disk files that belong to a ConversionLog (audio for TTS; .txt and generated .pdf for STT)."""
+    if not log.output_filename:
+        return []
+    if log.type == 'TTS':
+        return [os.path.join(root_path, 'static', 'audio', str(log.user_id), log.output_filename)]
+    if log.type == 'STT':
+        text_dir = os.path.join(root_path, 'static', 'text', str(log.user_id))
+        return [os.path.join(text_dir, log.output_filename),
+                os.path.join(text_dir, log.output_filename.replace('.txt', '.pdf'))]
+    return []
+
+
+def _remove_files(paths):
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing {path}: {e}")
+    print(f"Background cleanup removed {removed} of {len(paths)} files.")
+
+
+def remove_files_async(paths):
+    """Deletes files on a background thread so the request does not wait on thousands of unlink calls."""
+    if not paths:
+        return
+    threading.Thread(target=_remove_files, args=(list(paths),), daemon=True).start()
+
+
+class _ZipStreamBuffer:
+    """Write-only, non-seekable sink for zipfile. Whatever has been written so far is handed out by drain()."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, manifest_rows=None):
+    """
+    Generator yielding a ZIP archive piece by piece.
+    entries: iterable of (filepath, arcname); missing files are skipped.
+    manifest_rows: optional list of dicts written as manifest.csv at the end of the archive.
+    Files are copied in ZIP_BLOCK_BYTES blocks, so memory use stays flat regardless of archive size.
+    """
+    buffer = _ZipStreamBuffer()
+    # zipfile detects that the sink cannot seek and writes data descriptors after each member instead
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for filepath, arcname in entries:
+            if not os.path.exists(filepath):
+                continue
+            zinfo = zipfile.ZipInfo.from_file(filepath, arcname)
+            is_compressed = os.path.splitext(filepath)[1].lower() in COMPRESSED_EXTENSIONS
+            zinfo.compress_type = zipfile.ZIP_STORED if is_compressed else zipfile.ZIP_DEFLATED
+            with open(filepath, 'rb') as src, zf.open(zinfo, 'w') as dest:
+                while True:
+                    block = src.read(ZIP_BLOCK_BYTES)
+                    if not block:
+                        break
+                    dest.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+
+        if manifest_rows:
+            manifest = io.StringIO()
+            writer = csv.DictWriter(manifest, fieldnames=list(manifest_rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(manifest_rows)
+            zf.writestr('manifest.csv', manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+    yield buffer.drain()
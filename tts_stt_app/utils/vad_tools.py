@@ -0,0 +1,143 @@
+import tempfile
+import numpy as np
+from .audio_tools import DecodedAudio
+try:
+    import webrtcvad # Optional: more robust to background noise than the energy detector below
+    WEBRTCVAD_AVAILABLE = True
+except ImportError:
+    WEBRTCVAD_AVAILABLE = False
+    print("webrtcvad not found. Silence trimming will use the built-in energy detector.")
+
+# --- Voice activity detection (VAD) pre-pass for STT ---
+# Meetings and voicemails contain long silent stretches that Whisper and Vosk would otherwise run inference on.
+# find_speech_regions() marks 30 ms frames as speech or not; short pauses are bridged and each region gets some
+# padding so word edges are not clipped. trim_silence() then builds a new DecodedAudio holding only those regions,
+# plus a SpeechMap for turning times in the trimmed audio back into times in the original recording.
+FRAME_MS = 30 # webrtcvad accepts 10, 20 or 30 ms frames
+VAD_AGGRESSIVENESS = 2 # webrtcvad mode, 0 (keeps most audio) to 3 (most aggressive)
+MIN_SILENCE_SECONDS = 0.6 # Pauses shorter than this stay inside a speech region
+PADDING_SECONDS = 0.2 # Kept on both sides of each region
+MIN_SPEECH_SECONDS = 0.25 # Shorter bursts (clicks, bumps) are dropped
+MIN_SKIP_SECONDS = 1.0 # If VAD would remove less than this, the original audio is used unchanged
+
+# Energy detector: a frame is speech if it is this much louder than the recording's noise floor
+ENERGY_MARGIN_DB = 12.0
+ENERGY_MIN_DBFS = -55.0 # ...and never quieter than this absolute level
+ANALYSIS_BLOCK_SECONDS = 60 # Frames are analysed in blocks so memory-mapped recordings are not loaded at once
+
+
+class SpeechMap:
+    """
+    Maps times in trimmed audio back to the original recording.
+    regions: list of (original_start, original_end) in seconds, in order, as concatenated into the trimmed audio.
+    """
+    def __init__(self, regions, original_duration):
+        self.regions = regions
+        self.original_duration = original_duration
+        self._trimmed_starts = []
+        trimmed_start = 0.0
+        for start, end in regions:
+            self._trimmed_starts.append(trimmed_start)
+            trimmed_start += end - start
+        self.kept_seconds = trimmed_start
+
+    @property
+    def skipped_seconds(self):
+        return max(self.original_duration - self.kept_seconds, 0.0)
+
+    def to_original(self, trimmed_seconds):
+        """Converts a time in the trimmed audio into the matching time in the original audio."""
+        if not self.regions:
+            return trimmed_seconds
+        index = max(int(np.searchsorted(self._trimmed_starts, trimmed_seconds, side='right')) - 1, 0)
+        start, end = self.regions[index]
+        return min(start + (trimmed_seconds - self._trimmed_starts[index]), end)
+
+    def remap_segments(self, segments):
+        """Returns copies of Whisper-style segments ('start'/'end' in seconds) with times in the original audio."""
+        return [dict(segment, start=self.to_original(segment['start']), end=self.to_original(segment['end']))
+                for segment in segments]
+
+
+def _frame_flags_webrtc(audio, frame_samples):
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    frame_count = len(audio.samples) // frame_samples
+    flags = np.zeros(frame_count, dtype=bool)
+    for frame_index in range(frame_count):
+        start = frame_index * frame_samples
+        flags[frame_index] = vad.is_speech(audio.samples[start:start + frame_samples].tobytes(), audio.sample_rate)
+    return flags
+
+
+def _frame_flags_energy(audio, frame_samples):
+    frame_count = len(audio.samples) // frame_samples
+    levels = np.empty(frame_count, dtype=np.float32)
+    frames_per_block = max(1, int(ANALYSIS_BLOCK_SECONDS * 1000 / FRAME_MS))
+    for first_frame in range(0, frame_count, frames_per_block):
+        last_frame = min(first_frame + frames_per_block, frame_count)
+        block = audio.samples[first_frame * frame_samples:last_frame * frame_samples].astype(np.float32) / 32768.0
+        rms = np.sqrt(np.mean(block.reshape(-1, frame_samples) ** 2, axis=1))
+        levels[first_frame:last_frame] = 20 * np.log10(np.maximum(rms, 1e-10)) # dBFS
+    if frame_count == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(levels, 10)
+    return levels > max(noise_floor + ENERGY_MARGIN_DB, ENERGY_MIN_DBFS)
+
+
+def find_speech_regions(audio):
+    """Returns speech regions of a DecodedAudio as a list of (start, end) sample indexes, padded and merged."""
+    frame_samples = audio.sample_rate * FRAME_MS // 1000
+    use_webrtc = WEBRTCVAD_AVAILABLE and audio.sample_rate in (8000, 16000, 32000, 48000)
+    flags = _frame_flags_webrtc(audio, frame_samples) if use_webrtc else _frame_flags_energy(audio, frame_samples)
+
+    # Runs of speech frames -> [start, end) frame ranges
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    runs = zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+    min_gap_frames = int(MIN_SILENCE_SECONDS * 1000 / FRAME_MS)
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < min_gap_frames:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    padding = int(PADDING_SECONDS * audio.sample_rate)
+    min_speech = int(MIN_SPEECH_SECONDS * audio.sample_rate)
+    regions = []
+    for start_frame, end_frame in merged:
+        start, end = int(start_frame) * frame_samples, int(end_frame) * frame_samples
+        if end - start < min_speech:
+            continue
+        start, end = max(start - padding, 0), min(end + padding, len(audio.samples))
+        if regions and start <= regions[-1][1]: # Padding made neighbours overlap
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def trim_silence(audio, spill_dir=None):
+    """
+    Removes non-speech stretches from a DecodedAudio.
+    Returns (trimmed_audio, speech_map), or (audio, None) when there is too little silence to be worth it or no speech
+    was detected at all (the engine then sees the original audio, so a VAD miss never loses a transcript).
+    A memory-mapped input produces a memory-mapped output in spill_dir; the caller closes both.
+    """
+    regions = find_speech_regions(audio)
+    kept_samples = sum(end - start for start, end in regions)
+    if not regions or len(audio.samples) - kept_samples < MIN_SKIP_SECONDS * audio.sample_rate:
+        return audio, None
+
+    if audio.is_memory_mapped:
+        spill_file = tempfile.NamedTemporaryFile(prefix='speech_', suffix='.pcm', dir=spill_dir, delete=False)
+        with spill_file:
+            for start, end in regions:
+                spill_file.write(audio.samples[start:end].tobytes())
+        trimmed = DecodedAudio(np.memmap(spill_file.name, dtype=np.int16, mode='r'), audio.sample_rate,
+                               spill_path=spill_file.name)
+    else:
+        trimmed = DecodedAudio(np.concatenate([audio.samples[start:end] for start, end in regions]), audio.sample_rate)
+
+    speech_map = SpeechMap([(start / audio.sample_rate, end / audio.sample_rate) for start, end in regions], audio.duration)
+    return trimmed, speech_map
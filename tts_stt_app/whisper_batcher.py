@@ -0,0 +1,170 @@
+import dataclasses
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import torch
+import whisper
+
+# --- Dynamic cross-request batching for Whisper ---
+# Concurrent transcriptions split their audio into 30-second windows and submit the log-mel spectrogram of each
+# window here. A single inference thread collects windows from every pending request until it has max_batch_size
+# of them or max_wait_ms has passed since the first one arrived, then runs them through the encoder/decoder as one
+# batch (whisper.decode accepts a batch of mels) and hands each caller its own result.
+# Larger batches raise throughput (better use of CPU vector units / GPU); a longer wait raises per-request latency.
+#
+# Windows are decoded independently (no previous-text prompt, hard 30 s cuts), which is what makes them batchable.
+# Accuracy at window edges can be slightly lower than whisper_model.transcribe()'s sequential timestamp seeking.
+#
+# The model is shared with code that calls it directly (language detection, unbatched transcription), and
+# whisper.decode installs KV-cache hooks on the shared decoder modules, so every forward pass must hold model_lock.
+# The inference thread is started on first use in the process that uses it: a thread started before gunicorn forks
+# its workers would not exist in them.
+
+WINDOW_SAMPLES = whisper.audio.N_SAMPLES # 30 s at 16 kHz
+
+# The safeguards whisper_model.transcribe() applies to each window, with its default thresholds. A batch is decoded
+# greedily at temperature 0; windows that look like silence get empty text, and windows whose output looks
+# degenerate (repetition loops, low confidence) are decoded again, alone, at rising temperatures.
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+FALLBACK_TEMPERATURES = (0.2, 0.4, 0.6, 0.8, 1.0)
+FALLBACK_BEST_OF = 5 # Samples per fallback temperature, as in transcribe()
+
+
+def _is_silence(result):
+    return result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def _needs_fallback(result):
+    if _is_silence(result):
+        return False # Low confidence is expected on silence; it is blanked instead
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+class _PendingWindow:
+    def __init__(self, mel, options):
+        self.mel = mel
+        self.options = options
+        self.future = Future()
+
+
+class WhisperBatcher:
+    def __init__(self, model, max_batch_size=8, max_wait_ms=50, model_lock=None, result_timeout=300):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.model_lock = model_lock or threading.Lock()
+        self.result_timeout = result_timeout # Seconds a request waits for one window before giving up
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._pid = None # Process that owns the running thread
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            thread = threading.Thread(target=self._run, args=(self._queue,), name='whisper-batcher', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, mel, options):
+        """Queues one window's mel spectrogram (n_mels x 3000). Returns a Future resolving to a whisper DecodingResult."""
+        self._ensure_started()
+        pending = _PendingWindow(mel, options)
+        self._queue.put(pending)
+        return pending.future
+
+    def _collect_batch(self, work_queue):
+        batch = [work_queue.get()] # Block until there is work
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(work_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, work_queue):
+        while True:
+            batch = self._collect_batch(work_queue)
+            # Windows can only share a forward pass if they use the same decoding options (e.g. language)
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.options, []).append(pending)
+            for options, windows in groups.items():
+                try:
+                    mels = torch.stack([pending.mel for pending in windows]).to(self.model.device)
+                    with self.model_lock, torch.no_grad():
+                        results = whisper.decode(self.model, mels, options)
+                except Exception as e:
+                    print(f"Whisper batch of {len(windows)} windows failed: {e}")
+                    for pending in windows:
+                        pending.future.set_exception(e)
+                    continue
+                for pending, result in zip(windows, results):
+                    try:
+                        pending.future.set_result(self._checked_result(pending, result))
+                    except Exception as e:
+                        print(f"Whisper fallback decode failed: {e}")
+                        pending.future.set_exception(e)
+
+    def _checked_result(self, pending, result):
+        """Applies transcribe()'s temperature fallback and no-speech check to one window's batched result."""
+        for temperature in FALLBACK_TEMPERATURES:
+            if not _needs_fallback(result):
+                break
+            options = dataclasses.replace(pending.options, temperature=temperature, best_of=FALLBACK_BEST_OF)
+            with self.model_lock, torch.no_grad(): # One window at a time; other batches wait for the lock
+                result = whisper.decode(self.model, pending.mel.to(self.model.device), options)
+        if _is_silence(result):
+            result = dataclasses.replace(result, text='') # Otherwise silence comes back as e.g. "Thank you."
+        return result
+
+
+def iter_batched_segments(batcher, audio, language):
+    """
+    Transcribes a DecodedAudio through the batcher, yielding one segment dict ('start', 'end', 'text') per 30 s window,
+    in order, as soon as that window is decoded.
+    At most max_batch_size windows of this request are in flight at once, so concurrent requests share batches.
+    """
+    model = batcher.model
+    options = whisper.DecodingOptions(task='transcribe', language=language, without_timestamps=True,
+                                      fp16=model.device.type != 'cpu')
+    sample_rate = audio.sample_rate
+    window_starts = list(range(0, len(audio.samples), WINDOW_SAMPLES))
+
+    in_flight = []
+    for window_start in window_starts:
+        window_end = min(window_start + WINDOW_SAMPLES, len(audio.samples))
+        samples = whisper.pad_or_trim(audio.as_float32(window_start / sample_rate, window_end / sample_rate))
+        mel = whisper.log_mel_spectrogram(samples, n_mels=model.dims.n_mels)
+        in_flight.append((window_start, window_end, batcher.submit(mel, options)))
+        if len(in_flight) >= batcher.max_batch_size:
+            yield _finish_window(*in_flight.pop(0), sample_rate, batcher.result_timeout)
+    for window in in_flight:
+        yield _finish_window(*window, sample_rate, batcher.result_timeout)
+
+
+def transcribe_batched(batcher, audio, language):
+    """
+    Transcribes a DecodedAudio through the batcher. Returns a dict shaped like whisper_model.transcribe()'s result
+    ('text', 'language', 'segments' with one segment per 30 s window).
+    """
+    segments = list(iter_batched_segments(batcher, audio, language))
+    return {
+        'text': ' '.join(segment['text'] for segment in segments if segment['text']),
+        'language': language,
+        'segments': segments,
+    }
+
+
+def _finish_window(window_start, window_end, future, sample_rate, timeout):
+    result = future.result(timeout=timeout) # Raises TimeoutError rather than holding the inference slot forever
+    return {'start': window_start / sample_rate, 'end': window_end / sample_rate, 'text': result.text.strip()}